@@ -1,30 +1,169 @@
-import requests
-from PIL import Image, ImageEnhance, ImageFilter
-import pytesseract
-from io import BytesIO
 import logging
-pytesseract.pytesseract.tesseract_cmd = r"D:/Tesseract/tesseract.exe"
-OPEN_FOOD_FACTS_SEARCH_URL = "https://world.openfoodfacts.org/cgi/search.pl"
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from cache import DiskCache, MISSING
+from config import openfoodfacts_url
+from ingest import record_to_row
+from store import ProductStore
+from tracing import span, traced, annotate
+# requests/urllib3 and ocr (PIL, pytesseract) are imported where first needed:
+# scoring-only workers import this module but never open a connection or an image.
+OPEN_FOOD_FACTS_URL = openfoodfacts_url()
+OPEN_FOOD_FACTS_SEARCH_URL = f"{OPEN_FOOD_FACTS_URL}/cgi/search.pl"
 
+# Shared HTTP client: (connect, read) timeouts in seconds, pool size and retries.
+REQUEST_TIMEOUT = (3.05, 15)
+HTTP_POOL_SIZE = int(os.environ.get("FOOD_HTTP_POOL_SIZE", 32))
+HTTP_RETRIES = int(os.environ.get("FOOD_HTTP_RETRIES", 3))
+_session = None  # (pid, session): pooled keep-alive sockets must not cross a fork
+_session_lock = threading.Lock()
+
+# Local product cache (barcode and search lookups); see cache.DiskCache.
+CACHE_PATH = os.environ.get("FOOD_CACHE_PATH", "cache/openfoodfacts.sqlite")
+CACHE_TTL = float(os.environ.get("FOOD_CACHE_TTL", 24 * 3600))
+CACHE_NEGATIVE_TTL = float(os.environ.get("FOOD_CACHE_NEGATIVE_TTL", 3600))
+CACHE_MAX_ENTRIES = int(os.environ.get("FOOD_CACHE_MAX_ENTRIES", 10000))
+_product_cache = None
+
+# Offline product store filled by ingest.py; consulted before the network if present.
+PRODUCT_STORE_PATH = os.environ.get("FOOD_PRODUCT_STORE", "data/products.sqlite")
+_product_store = None
+
+
+def get_product_cache() -> DiskCache:
+    """Open the product cache on first use."""
+    global _product_cache
+    if _product_cache is None:
+        _product_cache = DiskCache(CACHE_PATH, table="products", ttl=CACHE_TTL,
+                                   negative_ttl=CACHE_NEGATIVE_TTL,
+                                   max_entries=CACHE_MAX_ENTRIES)
+    return _product_cache
+
+
+def get_product_store() -> ProductStore:
+    """Open the offline product store on first use; None if no dump was imported."""
+    global _product_store
+    if _product_store is None and os.path.exists(PRODUCT_STORE_PATH):
+        _product_store = ProductStore(PRODUCT_STORE_PATH)
+    return _product_store
+
+
+def get_session() -> "requests.Session":
+    """
+    Process-wide keep-alive session. Idempotent GETs are retried with
+    exponential backoff on connection errors, 429 and 5xx, honouring Retry-After.
+    """
+    global _session
+    with _session_lock:
+        if _session is None or _session[0] != os.getpid():
+            import requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+            retry = Retry(
+                total=HTTP_RETRIES,
+                backoff_factor=0.5,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=("GET", "HEAD"),
+                respect_retry_after_header=True,
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers["User-Agent"] = "PackagedFoodRatingApp/1.0"
+            _session = (os.getpid(), session)
+        return _session[1]
+
+
+def _reset_session_lock():
+    # A forked child gets the lock in whatever state another parent thread left it.
+    global _session_lock
+    _session_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_session_lock)
+
+
+@traced("acquire.barcode")
 def get_product_by_barcode(barcode:str)->dict:
     """
     Fetch product details from OpenFoodFacts using barcode.
+    Results, including "not found", are served from the local cache when fresh,
+    then from the offline product store, before going to the network.
     """
-    url = f"https://world.openfoodfacts.org/api/v0/product/{barcode}.json"
-    response = requests.get(url)
+    barcode = barcode.strip()
+    cache = get_product_cache()
+    key = f"barcode:{barcode}"
+    product = cache.get(key)
+    if product is not MISSING:
+        annotate(source="cache")
+        return product
+    store = get_product_store()
+    if store is not None and (product := store.get(barcode)) is not None:
+        annotate(source="store")
+        return product
+    annotate(source="network")
+    return _fetch_barcode(barcode)
+
+
+def _fetch_barcode(barcode: str) -> dict:
+    """Network half of get_product_by_barcode: fetch, cache and index one product."""
+    cache = get_product_cache()
+    key = f"barcode:{barcode}"
+    url = f"{OPEN_FOOD_FACTS_URL}/api/v0/product/{barcode}.json"
+    with span("http.fetch", url=url) as fetch:
+        response = get_session().get(url, timeout=REQUEST_TIMEOUT)
+        fetch.set(status=response.status_code, bytes=len(response.content))
     if response.status_code == 200:
         data = response.json()
-        if data.get("status") == 1:
-            return data["product"]
-        return None
+        product = data["product"] if data.get("status") == 1 else None
+        cache.set(key, product)
+        if product:
+            _index_products([dict(product, code=product.get("code") or barcode)])
+        return product
     else:
         response.raise_for_status()
 
+@traced("acquire.search")
 def search_product_name(name:str,page_size:int = 3) -> list:
     """
     Search OpenFoodFacts by product name.
     Returns a list of product dicts.
+    When an offline product store exists, its full-text index answers first
+    (prefix matching, ranked). OpenFoodFacts is only asked if the store finds
+    fewer than page_size products; its results then fill up the local ones.
+    If that request fails, the local matches are returned on their own.
     """
+    store = get_product_store()
+    local = store.search(name, limit=page_size) if store is not None else []
+    if len(local) >= page_size:
+        annotate(source="store")
+        return local
+    import requests
+    try:
+        remote = _search_remote(name, page_size)
+    except requests.exceptions.RequestException as e:
+        if not local:
+            raise
+        logging.warning(f"[INGEST] Product search fell back to {len(local)} local results: {name}: {e}")
+        return local
+    codes = {product.get("code") for product in local}
+    return local + [product for product in remote if product.get("code") not in codes][:page_size - len(local)]
+
+
+def _search_remote(name: str, page_size: int) -> list:
+    """OpenFoodFacts search results, from the lookup cache when fresh."""
+    cache = get_product_cache()
+    key = f"search:{page_size}:{' '.join(name.lower().split())}"
+    products = cache.get(key)
+    if products is not MISSING:
+        annotate(source="cache")
+        return products
+
     params = {
         "search_terms": name,
         "search_simple": 1,
@@ -32,47 +171,101 @@ def search_product_name(name:str,page_size:int = 3) -> list:
         "json": 1,
         "page_size": page_size,
     }
-    response = requests.get(OPEN_FOOD_FACTS_SEARCH_URL, params=params)
+    annotate(source="network")
+    with span("http.fetch", url=OPEN_FOOD_FACTS_SEARCH_URL) as fetch:
+        response = get_session().get(OPEN_FOOD_FACTS_SEARCH_URL, params=params, timeout=REQUEST_TIMEOUT)
+        fetch.set(status=response.status_code, bytes=len(response.content))
 
     if response.status_code == 200:
         data = response.json()
-        return data.get("products", [])
+        products = data.get("products", [])
+        cache.set(key, products, ttl=None if products else cache.negative_ttl)
+        _index_products(products)
+        return products
     else:
         response.raise_for_status()
 
 
-def extract_text_from_image_url(image_url:str)->str:
+def _index_products(products: list):
+    """Add network results to the offline store, so local search grows as products are seen."""
+    store = get_product_store()
+    if store is None or not products:
+        return
+    rows = [row for row in map(record_to_row, products) if row]
+    if rows:
+        store.put_many(rows)
+
+
+class _RateLimiter:
+    """Spaces out calls so at most `rate` start per second, across threads."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def get_products_by_barcodes(barcodes, concurrency: int = 8, rate_limit: float = 10.0) -> dict:
+    """
+    Resolve many barcodes concurrently over the shared session.
+    Cached or locally stored barcodes are answered immediately; the rest are
+    fetched by `concurrency` threads, starting at most `rate_limit` requests
+    per second (None for no limit). Returns {barcode: product or None};
+    barcodes whose lookup failed after retries are logged and left out.
+    Each barcode is looked up in the cache and store once, here; pending
+    ones go straight to the network.
+    """
+    cache = get_product_cache()
+    store = get_product_store()
+    results = {}
+    pending = []
+    for barcode in dict.fromkeys(b.strip() for b in barcodes if b and b.strip()):
+        product = cache.get(f"barcode:{barcode}")
+        if product is MISSING and store is not None:
+            product = store.get(barcode) or MISSING
+        if product is MISSING:
+            pending.append(barcode)
+        else:
+            results[barcode] = product
+
+    import requests
+    limiter = _RateLimiter(rate_limit) if rate_limit else None
+
+    def fetch(barcode):
+        if limiter:
+            limiter.wait()
+        return _fetch_barcode(barcode)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = {barcode: pool.submit(fetch, barcode) for barcode in pending}
+        for barcode, future in futures.items():
+            try:
+                results[barcode] = future.result()
+            except requests.exceptions.RequestException as e:
+                logging.warning(f"[INGEST] Barcode lookup failed: {barcode}: {e}")
+    return results
+
+
+def extract_text_from_image_url(image_url:str, cancel=None)->str:
     """
     Extract text from an online image URL using OCR with preprocessing.
+    Unchanged images are answered from the OCR cache (see ocr.ocr_url);
+    `cancel` (a threading.Event) aborts the job with ocr.OCRCancelled.
     """
+    import requests
+    from ocr import ocr_url, OCRCancelled
     try:
-        # 1. Fetch the image from the URL
-        response = requests.get(image_url, stream=True, timeout=10)
-        response.raise_for_status()  
-        # 2. Open the image with Pillow
-        img = Image.open(BytesIO(response.content))
-        
-        # 3. Preprocessing steps for better OCR accuracy
-        # Convert to grayscale
-        img = img.convert('L')
-        
-        # Increase contrast
-        enhancer = ImageEnhance.Contrast(img)
-        img = enhancer.enhance(2) # You can adjust this value
-        
-        # Apply a filter to sharpen the image
-        img = img.filter(ImageFilter.SHARPEN)
-        
-        # Binarize the image (convert to pure black and white) using a threshold
-        threshold = 128
-        img = img.point(lambda p: p > threshold and 255)
-        
-        # 4. Use pytesseract to extract text from the preprocessed image
-        text = pytesseract.image_to_string(img, lang="eng")
-        
-        # 5. Clean up the extracted text
-        return text.strip()
-        
+        return ocr_url(image_url, cancel=cancel)
+    except OCRCancelled:
+        raise
     except requests.exceptions.RequestException as e:
         print(f"Error fetching image from URL: {e}")
         return ""
@@ -85,9 +278,17 @@ def extract_text_from_local(image_path: str) -> str:
     """
     Extract text from a local image file.
     """
-    img = Image.open(image_path)
-    text = pytesseract.image_to_string(img, lang="eng")
-    return text.strip()
+    from ocr import ocr_file
+    return ocr_file(image_path, preprocess=False)
+
+
+
+def __getattr__(name):
+    # OCR helpers acquire used to re-export, now loaded on first access.
+    if name in ("ocr_url", "ocr_file", "extract_text_batch", "OCRCancelled"):
+        import ocr
+        return getattr(ocr, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 if __name__ == "__main__":
@@ -1,9 +1,14 @@
 import streamlit as st
-import re
 import logging
-from acquire import get_product_by_barcode, search_product_name, extract_text_from_image_url
-from normalize import normalize_ingredient, normalize_nutrient_name, extract_nutrition_from_text
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from acquire import (get_product_by_barcode, search_product_name,
+                     get_session, get_product_cache, REQUEST_TIMEOUT)
+from normalize import normalize_ingredients, extract_nutrition_from_text
 from score import calculate_score
+from catalog import NormalizedProduct
+from config import tesseract_path
 
 # --- Persistent logging setup ---
 log_filename = "run.log"
@@ -15,8 +20,195 @@ logging.basicConfig(
 )
 log = logging.info
 
+# Memoized pipeline steps, shared by every session in this process. Streamlit
+# reruns the script on each widget interaction; with these, a rerun whose
+# inputs haven't changed does no lookup, OCR, normalization or scoring work
+# (and logs nothing, since the log lines live inside the cached functions).
+PIPELINE_CACHE_TTL = 3600
+PIPELINE_CACHE_ENTRIES = 512
+IMAGE_CACHE_ENTRIES = 128
+
+# Lookups, OCR and image downloads run on a shared background pool; the page
+# polls for finished jobs every JOB_POLL_INTERVAL seconds instead of blocking.
+UI_WORKERS = int(os.environ.get("FOOD_UI_WORKERS", 8))
+JOB_POLL_INTERVAL = 0.25
+JOB_LABELS = {"lookup": "Looking up product", "search": "Searching products", "ocr": "Extracting text with OCR"}
+JOB_MODES = {"lookup": "Barcode", "search": "Product Name", "ocr": "Image URL"}
+
+
+@st.cache_resource(show_spinner=False)
+def pipeline_resources():
+    """Process-wide heavy objects: the pooled HTTP session, lookup cache and OCR config."""
+    return {
+        "session": get_session(),
+        "product_cache": get_product_cache(),
+        "tesseract_cmd": tesseract_path(),
+    }
+
+
+@st.cache_resource(show_spinner=False)
+def background_executor():
+    """Worker pool shared by every session for lookups, OCR and image prefetch."""
+    return ThreadPoolExecutor(max_workers=UI_WORKERS, thread_name_prefix="ui-job")
+
+
+@st.cache_data(ttl=PIPELINE_CACHE_TTL, max_entries=PIPELINE_CACHE_ENTRIES, show_spinner=False)
+def lookup_barcode(barcode):
+    product = get_product_by_barcode(barcode)
+    if product:
+        log(f"[INGEST] Barcode lookup: {barcode} → {product.get('product_name', '')}")
+        return NormalizedProduct.from_product(product)
+    log(f"[INGEST] Barcode lookup failed: {barcode}")
+    return None
+
+
+@st.cache_data(ttl=PIPELINE_CACHE_TTL, max_entries=PIPELINE_CACHE_ENTRIES, show_spinner=False)
+def lookup_name(query):
+    results = search_product_name(query, page_size=3)
+    log(f"[INGEST] Product search: {query} → {len(results)} results")
+    # Keep only the slim form; raw OFF records carry hundreds of unused keys.
+    return [NormalizedProduct.from_product(p) for p in results]
+
+
+def analyze_image(img_url, cancel=None):
+    """
+    OCR an image URL and normalize what it says: (ingredients, nutrients).
+    Not memoized here: ocr_url's cache revalidates the URL, so a changed
+    image is read again. Fetch and OCR errors raise (shown by job_result)
+    rather than returning empty text; setting `cancel` (a threading.Event)
+    aborts with ocr.OCRCancelled.
+    """
+    from ocr import ocr_url  # PIL/NumPy load with the first OCR job, not with the page
+    ocr_text = ocr_url(img_url, cancel=cancel)
+    log(f"[INGEST] OCR text extracted from URL: {img_url}")
+    return analyze_text(ocr_text)
+
+
+@st.cache_data(ttl=PIPELINE_CACHE_TTL, max_entries=PIPELINE_CACHE_ENTRIES, show_spinner=False)
+def analyze_text(ocr_text):
+    """Normalized (ingredients, nutrients) for a piece of OCR text, memoized on the text."""
+    ingreds = normalize_ingredients(ocr_text)
+    nutri = extract_nutrition_from_text(ocr_text)
+    nutri = {k: (v or 0) for k, v in nutri.items()}
+    log(f"[NORMALIZE] Ingredients: {ingreds}")
+    log(f"[NORMALIZE] Nutrients: {nutri}")
+    return ingreds, nutri
+
+
+@st.cache_data(ttl=PIPELINE_CACHE_TTL, max_entries=PIPELINE_CACHE_ENTRIES, show_spinner=False)
+def analyze_product(product_key, _product):
+    """
+    A NormalizedProduct's ingredients and nutrients: (ingredients, nutrients).
+    Memoized on product_key alone (the underscore keeps Streamlit from hashing
+    the product on every rerun).
+    """
+    ingreds = _product.ingredients
+    nutri = {k: (v or 0) for k, v in _product.nutrient_dict().items()}
+    log(f"[NORMALIZE] Product ingredients: {ingreds}")
+    log(f"[NORMALIZE] Product nutrients: {nutri}")
+    return ingreds, nutri
+
+
+@st.cache_data(ttl=PIPELINE_CACHE_TTL, max_entries=PIPELINE_CACHE_ENTRIES, show_spinner=False)
+def score_nutrients(nutri_items):
+    log(f"[SCORE] Calculation started")
+    score, grade, band, drivers, evidence = calculate_score(dict(nutri_items))
+    log(f"[SCORE] Result: {score}, Band: {band}, Grade: {grade}")
+    log(f"[EXPLAIN] Drivers: {drivers}")
+    log(f"[EXPLAIN] Evidence: {evidence}")
+    return score, grade, band, drivers, evidence
+
+
+@st.cache_data(ttl=PIPELINE_CACHE_TTL, max_entries=IMAGE_CACHE_ENTRIES, show_spinner=False)
+def fetch_image(url):
+    """Product image bytes through the pooled session, or None if it can't be fetched."""
+    import requests  # loaded by get_session() anyway; only needed here for the exception type
+    try:
+        response = get_session().get(url, timeout=REQUEST_TIMEOUT)
+        response.raise_for_status()
+        return response.content
+    except requests.exceptions.RequestException as e:
+        log(f"[INGEST] Image fetch failed: {url}: {e}")
+        return None
+
+
+def start_job(name, func, *args, **kwargs):
+    """Run func on the background pool, replacing any unfinished job of the same name."""
+    cancel_job(name)
+    st.session_state.jobs[name] = background_executor().submit(func, *args, **kwargs)
+
+
+def cancel_job(name):
+    """Drop a job; a queued job never starts, a running OCR job stops at its next step."""
+    future = st.session_state.jobs.pop(name, None)
+    if future is not None:
+        future.cancel()
+        if name == "ocr":
+            st.session_state.ocr_cancel.set()
+
+
+def cancel_other_modes(mode):
+    """Drop jobs started from another search mode; only their own branch would collect them."""
+    for name in [name for name in st.session_state.jobs if JOB_MODES[name] != mode]:
+        cancel_job(name)
+
+
+def job_result(name):
+    """(True, result) once a job has finished and was collected, else (False, None)."""
+    future = st.session_state.jobs.get(name)
+    if future is None or not future.done():
+        return False, None
+    del st.session_state.jobs[name]
+    try:
+        return True, future.result()
+    except Exception as e:
+        from ocr import OCRCancelled  # already loaded if the job was OCR
+        if isinstance(e, OCRCancelled):
+            return False, None
+        logging.error(f"[INGEST] {JOB_LABELS[name]} failed: {e}")
+        st.error(f"{JOB_LABELS[name]} failed: {e}")
+        return False, None
+
+
+def prefetch_images(products):
+    """Start downloading product images while the rest of the page renders."""
+    for product in products:
+        url = product.get("image_url")
+        if url and url not in st.session_state.images:
+            st.session_state.images[url] = background_executor().submit(fetch_image, url)
+
+
+def show_image(url):
+    """The prefetched image, or a placeholder until its download finishes."""
+    future = st.session_state.images.get(url)
+    if future is None:
+        return
+    if not future.done():
+        st.session_state.images_waiting.add(url)
+        st.caption("Loading image…")
+    elif future.result():
+        st.image(future.result(), width=240)
+
+
+@st.fragment(run_every=JOB_POLL_INTERVAL)
+def poll_jobs():
+    """Show running jobs; rerun the whole page as soon as any of them finishes."""
+    images = st.session_state.images
+    if any(future.done() for future in st.session_state.jobs.values()) or \
+            any(images[url].done() for url in st.session_state.images_waiting):
+        st.rerun()
+    for name in st.session_state.jobs:
+        st.caption(f"⏳ {JOB_LABELS[name]}…")
+
+
+def product_key(product):
+    """Stable cache key for a NormalizedProduct: its barcode, else name and ingredients."""
+    return product.code or f"{product.product_name}|{','.join(product.ingredients)}"
+
+
 # --- Streamlit setup ---
 st.set_page_config(page_title="Health Analyzer", layout="centered")
+pipeline_resources()
 st.markdown("<h2 style='color:#FFD600; text-align:center;'>Packaged Food Rating App</h2>", unsafe_allow_html=True)
 
 st.markdown("""
@@ -50,8 +242,12 @@ def color_band(band):
 if 'product' not in st.session_state: st.session_state.product = None
 if 'ingreds' not in st.session_state: st.session_state.ingreds = []
 if 'nutri' not in st.session_state: st.session_state.nutri = {}
+if 'jobs' not in st.session_state: st.session_state.jobs = {}
+if 'images' not in st.session_state: st.session_state.images = {}
+if 'ocr_cancel' not in st.session_state: st.session_state.ocr_cancel = threading.Event()
+st.session_state.images_waiting = set()
 
-log("=== NEW RUN START ===")
+logging.debug("=== NEW RUN START ===")
 
 with st.sidebar:
     st.markdown('<h3 style="color:#FFD600;">Search Options</h3>', unsafe_allow_html=True)
@@ -71,6 +267,9 @@ def search_by_name():
 def search_by_image():
     st.info("🔍 Searching by Image URL... (implement logic here)")
 
+# A finished job that nobody collects would keep poll_jobs rerunning the page.
+cancel_other_modes(search_mode)
+
 # --- Route based on selection ---
 if search_mode == "Barcode":
     search_by_barcode()
@@ -83,26 +282,34 @@ elif search_mode == "Image URL":
 if search_mode == "Barcode":
     barcode = st.sidebar.text_input("Enter product barcode:")
     if st.sidebar.button("Fetch Product", use_container_width=True):
-        with st.spinner("Looking up product..."):
-            product = get_product_by_barcode(barcode)
-            if product:
-                st.session_state.product = product
-                log(f"[INGEST] Barcode lookup: {barcode} → {product.get('product_name', '')}")
-                st.success(f"Found: {product.get('product_name', '')}")
-                st.image(product.get('image_url', ""), width=240)
-            else:
-                log(f"[INGEST] Barcode lookup failed: {barcode}")
-                st.error("No product found.")
+        st.session_state.product = None
+        start_job("lookup", lookup_barcode, barcode.strip())
+    done, product = job_result("lookup")
+    if done:
+        if product:
+            st.session_state.product = product
+            prefetch_images([product])
+        else:
+            st.error("No product found.")
+    # Product card first; the image fills in when its download finishes.
+    product = st.session_state.product
+    if product:
+        st.success(f"Found: {product.get('product_name', '')}")
+        show_image(product.get('image_url'))
 # --- Product name search ---
 elif search_mode == "Product Name":
     query = st.sidebar.text_input("Enter product name:")
 
     # Search results button
     if st.sidebar.button("Search Products", use_container_width=True):
-        results = search_product_name(query, page_size=3)
+        start_job("search", lookup_name, query)
+    done, results = job_result("search")
+    if done:
         if results:
             st.session_state.search_results = results
             st.session_state.selected_product_idx = 0
+            # Download every result's image up front so switching between them is instant.
+            prefetch_images(results)
         else:
             st.session_state.search_results = []
             st.session_state.selected_product_idx = None
@@ -133,72 +340,66 @@ elif search_mode == "Product Name":
 
         # Display product info
         st.success(f"Selected: {product.get('product_name', '')}")
-        st.image(product.get('image_url', ""), width=240)
-        log(f"[INGEST] Product search: {query} → Selected {product.get('product_name', '')}")
+        show_image(product.get('image_url'))
+        if st.session_state.get("logged_selection") != product_key(product):
+            st.session_state.logged_selection = product_key(product)
+            log(f"[INGEST] Product search: {query} → Selected {product.get('product_name', '')}")
 
 # --- Image/OCR input ---
 elif search_mode == "Image URL":
     img_url = st.sidebar.text_input("Enter packaging image URL:")
     if st.sidebar.button("Extract Text", use_container_width=True):
-        with st.spinner("Extracting text with OCR..."):
-            ocr_text = extract_text_from_image_url(img_url)
-            ingreds = [normalize_ingredient(i) for i in re.split(r',|\n|;', ocr_text) if i.strip()]
-            nutri = extract_nutrition_from_text(ocr_text)
-            nutri = {k: (v or 0) for k, v in nutri.items()}
-            
-            # Update session state
-            st.session_state.product = None
-            st.session_state.ingreds = ingreds
-            st.session_state.nutri = nutri
-            
-            # Logging
-            log(f"[INGEST] OCR text extracted from URL: {img_url}")
-            log(f"[NORMALIZE] Ingredients: {ingreds}")
-            log(f"[NORMALIZE] Nutrients: {nutri}")
-            
-            # --- Display OCR results ---
-            st.markdown("<h4 style='color:#FFD600;'>Extracted & Normalized Ingredients:</h4>", unsafe_allow_html=True)
-            st.write(ingreds or "No ingredient info detected.")
-            
-            st.markdown("<h4 style='color:#FFD600;'>Extracted Nutritional Information:</h4>", unsafe_allow_html=True)
-            st.write(nutri or "No nutritional info detected.")
+        # Stop the previous job first: cancel_job sets ocr_cancel, which must
+        # still be that job's event, not the new one's.
+        cancel_job("ocr")
+        st.session_state.ocr_cancel = threading.Event()
+        start_job("ocr", analyze_image, img_url.strip(), st.session_state.ocr_cancel)
+    if "ocr" in st.session_state.jobs and st.sidebar.button("Cancel OCR", use_container_width=True):
+        cancel_job("ocr")
+        st.info("OCR cancelled.")
+    done, analysis = job_result("ocr")
+    if done:
+        ingreds, nutri = analysis
+
+        # Update session state
+        st.session_state.product = None
+        st.session_state.ingreds = ingreds
+        st.session_state.nutri = nutri
+
+        # --- Display OCR results ---
+        st.markdown("<h4 style='color:#FFD600;'>Extracted & Normalized Ingredients:</h4>", unsafe_allow_html=True)
+        st.write(ingreds or "No ingredient info detected.")
+
+        st.markdown("<h4 style='color:#FFD600;'>Extracted Nutritional Information:</h4>", unsafe_allow_html=True)
+        st.write(nutri or "No nutritional info detected.")
 
 # --- Display product details & normalize ---
 if st.session_state.product:
     product = st.session_state.product
-    ingreds = [normalize_ingredient(i) for i in re.split(r',|\n|;', product.get("ingredients_text") or "") if i.strip()]
-    nutri = normalize_nutrient_name(product.get("nutriments", {}))
-    nutri = {k: (v or 0) for k, v in nutri.items()}
+    ingreds, nutri = analyze_product(product_key(product), product)
     st.session_state.ingreds = ingreds
     st.session_state.nutri = nutri
     st.markdown("<h4 style='color:#FFD600;'>Normalized Ingredients:</h4>", unsafe_allow_html=True)
     st.write(ingreds or "No ingredient info available.")
     st.markdown("<h4 style='color:#FFD600;'>Nutritional Information (per 100g):</h4>", unsafe_allow_html=True)
     st.write(nutri)
-    log(f"[NORMALIZE] Product ingredients: {ingreds}")
-    log(f"[NORMALIZE] Product nutrients: {nutri}")
 
 # --- Health Score Analysis ---
 if (st.session_state.nutri and st.session_state.ingreds) or st.session_state.product:
-    if st.button("Analyze Health Score", key="score_button"):
-        nutri = st.session_state.nutri
-        log(f"[SCORE] Calculation started")
-        score, grade, band, drivers, evidence = calculate_score(nutri)
-
-        # Display score
-        st.markdown(
-            f"<h2 style='background-color:{color_band(band)}; color:#16181b; padding:0.4em 1em; border-radius:10px; text-align:center;'>{score} : {band}</h2>",
-            unsafe_allow_html=True
-        )
-        
-        # Explanation panel
-        with st.expander("Score Drivers & Evidence", expanded=True):
-            for d, e in zip(drivers, evidence):
-                st.markdown(f"<div style='color:#ffd600'><b>{d}</b><br><i>{e}</i></div>", unsafe_allow_html=True)
+    # Rendered as soon as nutrients are known; score_nutrients is memoized, so reruns are free.
+    nutri = st.session_state.nutri
+    score, grade, band, drivers, evidence = score_nutrients(tuple(sorted(nutri.items())))
 
-        log(f"[SCORE] Result: {score}, Band: {band}, Grade: {grade}")
-        log(f"[EXPLAIN] Drivers: {drivers}")
-        log(f"[EXPLAIN] Evidence: {evidence}")
+    # Display score
+    st.markdown(
+        f"<h2 style='background-color:{color_band(band)}; color:#16181b; padding:0.4em 1em; border-radius:10px; text-align:center;'>{score} : {band}</h2>",
+        unsafe_allow_html=True
+    )
+
+    # Explanation panel
+    with st.expander("Score Drivers & Evidence", expanded=True):
+        for d, e in zip(drivers, evidence):
+            st.markdown(f"<div style='color:#ffd600'><b>{d}</b><br><i>{e}</i></div>", unsafe_allow_html=True)
 
 # --- Info if nothing selected ---
 if not st.session_state.product and not (st.session_state.ingreds and st.session_state.nutri):
@@ -209,4 +410,8 @@ st.markdown(
     """<div style='color:#ffd600;font-size:1rem;margin-top:1.5em;'>Scoring based on Nutri-Score, UK FSA, and WHO guidelines.<br>See documentation for sources.</div>""", 
     unsafe_allow_html=True
 )
-log("=== RUN COMPLETE ===\n")
\ No newline at end of file
+
+# --- Background jobs still running: poll until they finish ---
+if st.session_state.jobs or st.session_state.images_waiting:
+    poll_jobs()
+logging.debug("=== RUN COMPLETE ===\n")
\ No newline at end of file
@@ -0,0 +1,242 @@
+"""
+Score a file of barcodes or products end to end, without the UI.
+
+    python batch.py barcodes.csv -o scores.jsonl --workers 16
+    cat barcodes.txt | python batch.py - -o scores.jsonl
+    python batch.py products.jsonl -o scores_parquet --format parquet
+
+Input is CSV (a "barcode"/"code" column, or OFF product columns), JSONL
+(objects with a barcode, or whole OFF product records), or plain lines of
+barcodes. Each record goes through acquire -> normalize -> calculate_score
+on a thread pool, and results are written in input order in the shape of
+samples/outputs/*.json. Progress is checkpointed next to the output, so
+rerunning the same command after an interruption resumes where it stopped.
+"""
+import argparse
+import csv
+import glob
+import io
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from acquire import get_product_by_barcode
+from normalize import normalize_ingredients, normalize_nutrient_name, product_ingredients_text
+from score import calculate_score
+from store import NUTRIMENT_FIELDS
+from rules import load_rules
+from tracing import span, annotate, profiled, set_tracing, stage_stats, format_stats
+
+
+def iter_input(path: str):
+    """Yield input records (dicts or barcode strings) from a file or stdin ("-")."""
+    f = sys.stdin if path == "-" else open(path, "r", encoding="utf-8", newline="")
+    try:
+        if path.endswith(".csv"):
+            yield from csv.DictReader(f)
+            return
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                yield json.loads(line)
+            else:
+                yield line
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def score_record(record, ruleset=None) -> dict:
+    """Run one input record through the pipeline and build its output row."""
+    if isinstance(record, dict) and ("nutriments" in record or "ingredients_text" in record
+                                     or any(k in record for k in NUTRIMENT_FIELDS)):
+        product = record
+        barcode = record.get("code") or record.get("barcode") or ""
+    else:
+        barcode = (record.get("barcode") or record.get("code") or "") if isinstance(record, dict) else record
+        barcode = str(barcode).strip()
+        product = get_product_by_barcode(barcode)
+        if product is None:
+            return {"barcode": barcode, "error": "product not found"}
+
+    annotate(product=product.get("product_name") or barcode)
+    nutriments = product.get("nutriments")
+    if not isinstance(nutriments, dict):
+        nutriments = {k: product[k] for k in NUTRIMENT_FIELDS if product.get(k) not in (None, "")}
+    ingredients = normalize_ingredients(*product_ingredients_text(product))
+    nutrients = {k: (v or 0) for k, v in normalize_nutrient_name(nutriments).items()}
+    score, grade, band, drivers, evidence = calculate_score(nutrients, ruleset)
+    return {
+        "barcode": barcode,
+        "product_name": product.get("product_name", ""),
+        "ingredients": ingredients,
+        "nutrients": nutrients,
+        "score": {"value": score, "band": band, "grade": grade},
+        "explanation": {"drivers": drivers, "evidence": evidence},
+    }
+
+
+def _timed_score(record, ruleset=None):
+    started = time.perf_counter()
+    try:
+        with span("pipeline"):
+            row = score_record(record, ruleset)
+    except Exception as e:
+        barcode = record.get("barcode") or record.get("code") if isinstance(record, dict) else record
+        row = {"barcode": barcode, "error": f"{type(e).__name__}: {e}"}
+    return row, time.perf_counter() - started
+
+
+class _JsonlSink:
+    """Appends JSON lines; the checkpoint records the byte offset of the last flush."""
+
+    def __init__(self, path: str, checkpoint: dict):
+        self.file = open(path, "a+b")
+        # Drop anything written after the last checkpoint (a crash mid-batch).
+        self.file.truncate(checkpoint.get("offset", 0))
+        self.file.seek(0, io.SEEK_END)
+
+    def write(self, row: dict):
+        self.file.write(json.dumps(row, ensure_ascii=False).encode("utf-8") + b"\n")
+
+    def flush(self) -> dict:
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return {"offset": self.file.tell()}
+
+    def close(self):
+        self.file.close()
+
+
+class _ParquetSink:
+    """Writes one part-NNNNN.parquet file per flush into a directory."""
+
+    def __init__(self, path: str, checkpoint: dict):
+        import pandas as pd  # pandas.to_parquet needs pyarrow installed
+        self.pd = pd
+        self.path = path
+        self.part = checkpoint.get("part", 0)
+        self.rows = []
+        os.makedirs(path, exist_ok=True)
+        for stale in glob.glob(os.path.join(path, "part-*.parquet")):
+            if int(os.path.basename(stale)[5:10]) >= self.part:
+                os.remove(stale)
+
+    def write(self, row: dict):
+        self.rows.append(row)
+
+    def flush(self) -> dict:
+        if self.rows:
+            frame = self.pd.json_normalize(self.rows)
+            frame.to_parquet(os.path.join(self.path, f"part-{self.part:05d}.parquet"), index=False)
+            self.part += 1
+            self.rows = []
+        return {"part": self.part}
+
+    def close(self):
+        pass
+
+
+def run(input_path: str, output_path: str, workers: int = 8, fmt: str = "jsonl",
+        restart: bool = False, flush_every: int = 500, rules: str = None) -> dict:
+    """Score every input record into output_path; returns the run summary."""
+    checkpoint_path = output_path.rstrip("/\\") + ".checkpoint"
+    checkpoint = {}
+    if not restart and os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as f:
+            checkpoint = json.load(f)
+        logging.info(f"[BATCH] Resuming {input_path} after {checkpoint.get('done', 0)} records")
+    done = checkpoint.get("done", 0)
+    sink = (_ParquetSink if fmt == "parquet" else _JsonlSink)(output_path, checkpoint)
+
+    def save_checkpoint():
+        state = dict(sink.flush(), done=done, input=input_path)
+        tmp = checkpoint_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, checkpoint_path)
+
+    started = time.perf_counter()
+    latencies = []
+    errors = 0
+    records = itertools.islice(iter_input(input_path), done, None)
+    pool = ThreadPoolExecutor(max_workers=workers)
+    window = deque()
+
+    def emit(future):
+        nonlocal done, errors
+        row, seconds = future.result()
+        sink.write(row)
+        latencies.append(seconds)
+        errors += "error" in row
+        done += 1
+        if done % flush_every == 0:
+            save_checkpoint()
+
+    try:
+        for record in records:
+            window.append(pool.submit(_timed_score, record, rules))
+            if len(window) >= workers * 4:
+                emit(window.popleft())
+        while window:
+            emit(window.popleft())
+    except KeyboardInterrupt:
+        logging.warning(f"[BATCH] Interrupted after {done} records; rerun to resume")
+    finally:
+        for future in window:
+            future.cancel()
+        pool.shutdown(wait=True, cancel_futures=True)
+        save_checkpoint()
+        sink.close()
+
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+
+    def pct(p):
+        return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1e3, 2) if latencies else None
+
+    summary = {
+        "records": len(latencies), "total_done": done, "errors": errors,
+        "seconds": round(elapsed, 2),
+        "records_per_s": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {"p50": pct(0.50), "p95": pct(0.95), "p99": pct(0.99)},
+        "stages": stage_stats(),
+    }
+    logging.info(f"[BATCH] Summary: {summary}")
+    return summary
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    parser = argparse.ArgumentParser(description="Score barcodes or product records in bulk.")
+    parser.add_argument("input", help='CSV, JSONL or barcode-per-line file, or "-" for stdin')
+    parser.add_argument("-o", "--output", required=True, help="output .jsonl file (or directory for parquet)")
+    parser.add_argument("--format", choices=("jsonl", "parquet"), default="jsonl")
+    parser.add_argument("--workers", type=int, default=8, help="concurrent pipeline workers")
+    parser.add_argument("--flush-every", type=int, default=500, help="records between checkpoints")
+    parser.add_argument("--restart", action="store_true", help="ignore any checkpoint and start over")
+    parser.add_argument("--rules", help="scoring rules version (default: FOOD_RULES_VERSION or v1)")
+    parser.add_argument("--profile", choices=("cprofile", "pyinstrument"),
+                        help="profile the run (default: FOOD_PROFILE)")
+    parser.add_argument("--no-stats", action="store_true",
+                        help="skip per-stage timing (a few µs per record) and its table")
+    args = parser.parse_args()
+    try:
+        load_rules(args.rules)
+    except ValueError as e:
+        parser.error(str(e))
+
+    set_tracing(not args.no_stats)
+    with profiled(args.profile):
+        summary = run(args.input, args.output, workers=args.workers, fmt=args.format,
+                      restart=args.restart, flush_every=args.flush_every, rules=args.rules)
+    stages = summary.pop("stages")
+    if stages:
+        print(format_stats(stages), file=sys.stderr)
+    print(json.dumps(summary), file=sys.stderr)
@@ -0,0 +1,67 @@
+"""
+Benchmark: cold import time of the pipeline modules, each in a fresh
+interpreter, using python -X importtime.
+
+    python benchmarks/bench_import.py [--repeat 5] [normalize score ...]
+
+For each module it prints the best wall time of `python -c "import <module>"`,
+the cumulative import time that -X importtime reports for the module, the
+heavy dependencies the import loaded, and the slowest imports beneath it.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = ["normalize", "score", "acquire", "ingest", "batch", "service", "ocr"]
+HEAVY = ("numpy", "pandas", "PIL", "pytesseract", "requests", "streamlit")
+
+
+def import_once(module: str):
+    """(wall seconds, {direct import of module: cumulative us, module: total}, heavy modules loaded)."""
+    probe = f"import sys, {module}; print(','.join(m for m in {HEAVY!r} if m in sys.modules))"
+    started = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", probe], cwd=ROOT,
+                          capture_output=True, text=True, check=True)
+    wall = time.perf_counter() - started
+    # Nested imports are listed before their importer, indented two spaces per level.
+    cumulative, children = {}, {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cum, name = line[len("import time:"):].split("|")
+        if not cum.strip().isdigit():
+            continue
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 0:
+            if name.strip() == module:
+                cumulative = dict(children, **{module: int(cum)})
+            children = {}
+        elif depth == 1:
+            children[name.strip()] = int(cum)
+    return wall, cumulative, proc.stdout.strip()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("modules", nargs="*", default=MODULES, help="modules to import")
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters per module")
+    parser.add_argument("--top", type=int, default=3, help="slowest dependencies to list")
+    args = parser.parse_args()
+
+    baseline = min(import_once("sys")[0] for _ in range(args.repeat))
+    print(f"{'interpreter':>12}: {baseline * 1e3:7.1f} ms wall")
+    for module in args.modules:
+        runs = [import_once(module) for _ in range(args.repeat)]
+        wall, cumulative, heavy = min(runs, key=lambda run: run[0])
+        slowest = sorted(((us, name) for name, us in cumulative.items() if name != module),
+                         reverse=True)[:args.top]
+        print(f"{module:>12}: {(wall - baseline) * 1e3:7.1f} ms wall  "
+              f"{cumulative.get(module, 0) / 1e3:7.1f} ms importtime  loads [{heavy}]  "
+              + "  ".join(f"{name} {us / 1e3:.0f}" for us, name in slowest))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Benchmark: IngredientIndex build and query time on a synthetic catalog,
+after checking allergen queries against a hand-made one.
+
+    python benchmarks/bench_index.py [--products 200000] [--repeat 20]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from catalog import Catalog, NormalizedProduct, Vocabulary
+from ingredient_index import IngredientIndex
+from normalize import SYNONYMS
+
+INGREDIENTS = ["wheat flour", "milk chocolate", "sugar", "skimmed milk powder", "water", "egg yolk",
+               "hydrogenated vegetable oil", "cocoa butter", "salt", "whey protein", "rice", "hazelnuts"]
+QUERIES = ["wheat AND NOT milk", "(egg OR milk) AND NOT \"trans fat\"", "fat AND grade <= C", "water"]
+
+
+def product(code: str, ingredients: str) -> dict:
+    return {"code": code, "product_name": code, "ingredients_text": ingredients,
+            "nutriments": {"energy-kcal_100g": 400, "sugars_100g": 20}}
+
+
+def check_allergens():
+    """Canonical terms inside an ingredient ("milk powder", "milk chocolate") must match."""
+    catalog = Catalog.build([product("1", "wheat flour, milk chocolate, sugar"),
+                             product("2", "wheat flour, skimmed milk powder"),
+                             product("3", "wheat flour, water")], Vocabulary(SYNONYMS))
+    index = IngredientIndex.build(catalog)
+    verify(index, {"wheat AND NOT milk": ["3"], "milk": ["1", "2"], "sugar AND milk": ["1"]})
+    # Incremental updates: a new product, and product 2 re-indexed without milk.
+    index.add(NormalizedProduct.from_product(product("4", "wheat, trans fat"), catalog.vocabulary), grade="D")
+    index.add(NormalizedProduct.from_product(product("2", "wheat flour, water"), catalog.vocabulary))
+    verify(index, {"wheat AND NOT milk": ["2", "3", "4"], "milk": ["1"], "fat": ["4"], "fat AND grade = D": ["4"]})
+    # A longer barcode must be a new product, not product 1 truncated to the column width.
+    index.add(NormalizedProduct.from_product(product("10", "egg"), catalog.vocabulary))
+    verify(index, {"egg": ["10"], "milk": ["1"]})
+
+
+def verify(index: IngredientIndex, expected: dict):
+    for query, codes in expected.items():
+        found = index.search(query)
+        print(f"{'ok' if found == codes else 'MISMATCH'}: {query!r} -> {found} (expected {codes})")
+        if found != codes:
+            sys.exit(1)
+
+
+def synthetic_catalog(n: int) -> Catalog:
+    rng = random.Random(42)
+    return Catalog.build(product(str(i), ", ".join(rng.sample(INGREDIENTS, rng.randint(2, 6))))
+                         for i in range(n))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--products", type=int, default=200_000, help="synthetic catalog size")
+    parser.add_argument("--repeat", type=int, default=20, help="runs per query timing")
+    args = parser.parse_args()
+
+    check_allergens()
+    catalog = synthetic_catalog(args.products)
+    started = time.perf_counter()
+    index = IngredientIndex.build(catalog)
+    print(f"build: {time.perf_counter() - started:.2f} s for {len(catalog):,} products")
+    for query in QUERIES:
+        seconds = min(timeit.repeat(lambda: index.query(query), number=args.repeat, repeat=3)) / args.repeat
+        print(f"{query!r:>40}: {seconds * 1e3:7.2f} ms  {len(index.query(query)):,} matches")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Micro-benchmark: normalize_ingredient with the precompiled synonym matcher
+versus the previous one-re.sub-per-variant loop.
+
+    python benchmarks/bench_normalize.py [--repeat 20]
+"""
+import argparse
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from normalize import SYNONYMS, normalize_ingredient
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "off_ingredients.txt")
+
+
+def legacy_normalize_ingredient(ingredient: str) -> str:
+    """The per-variant implementation normalize_ingredient replaced."""
+    ingredient = ingredient.lower()
+    ingredient = re.sub(r'[^\w\s]', '', ingredient)
+    for standard, variants in SYNONYMS.items():
+        for var in variants:
+            pattern = r'\b' + re.escape(var) + r'\b'
+            ingredient = re.sub(pattern, standard, ingredient)
+    return ingredient.strip()
+
+
+def load_tokens(path: str = FIXTURE) -> list:
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    return [tok for tok in re.split(r',|;|\n', text) if tok.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20, help="passes over the corpus per timing")
+    args = parser.parse_args()
+
+    tokens = load_tokens()
+    mismatches = [t for t in tokens if normalize_ingredient(t) != legacy_normalize_ingredient(t)]
+    for tok in mismatches:
+        print(f"differs: {tok!r}: {legacy_normalize_ingredient(tok)!r} -> {normalize_ingredient(tok)!r}")
+
+    results = {}
+    for label, fn in [("legacy", legacy_normalize_ingredient), ("matcher", normalize_ingredient)]:
+        seconds = min(timeit.repeat(lambda: [fn(t) for t in tokens], number=args.repeat, repeat=3))
+        results[label] = len(tokens) * args.repeat / seconds
+        print(f"{label:>8}: {results[label]:>12,.0f} tokens/s")
+    print(f"speedup: {results['matcher'] / results['legacy']:.1f}x over {len(tokens)} tokens")
+
+
+if __name__ == "__main__":
+    main()
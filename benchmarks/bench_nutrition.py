@@ -0,0 +1,77 @@
+"""
+Benchmark: single-pass extract_nutrition_from_text versus the previous
+seven-regex version, on the OCR dumps in fixtures/ocr.
+
+    python benchmarks/bench_nutrition.py [--repeat 200]
+"""
+import argparse
+import glob
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from normalize import extract_nutrition_from_text
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "ocr")
+
+
+def legacy_extract_nutrition_from_text(raw_text: str) -> dict:
+    """The implementation extract_nutrition_from_text replaced."""
+    res = {}
+    if m := re.search(r"(\d+)\s*(kcal|cal)", raw_text.lower()):
+        res["energy_kcal"] = float(m.group(1))
+    if m := re.search(r"(\d+\.?\d*)\s*g\s*fat", raw_text.lower()):
+        res["fat_g"] = float(m.group(1))
+    if m := re.search(r"(\d+\.?\d*)\s*g\s*saturat", raw_text.lower()):
+        res["saturated_fat_g"] = float(m.group(1))
+    if m := re.search(r"(\d+\.?\d*)\s*g\s*carbohydrate", raw_text.lower()):
+        res["carbohydrate_g"] = float(m.group(1))
+    if m := re.search(r"(\d+\.?\d*)\s*g\s*sugars?", raw_text.lower()):
+        res["sugars_g"] = float(m.group(1))
+    if m := re.search(r"(\d+\.?\d*)\s*g\s*fiber", raw_text.lower()):
+        res["fiber_g"] = float(m.group(1))
+    if m := re.search(r"(\d+\.?\d*)\s*g\s*salt", raw_text.lower()):
+        res["salt_g"] = float(m.group(1))
+    return res
+
+
+def load_dumps(path: str = FIXTURES) -> dict:
+    dumps = {}
+    for name in sorted(glob.glob(os.path.join(path, "*.txt"))):
+        with open(name, encoding="utf-8") as f:
+            dumps[os.path.basename(name)] = f.read()
+    return dumps
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=200, help="passes over the fixtures per timing")
+    args = parser.parse_args()
+
+    dumps = load_dumps()
+    for name, text in dumps.items():
+        old, new = legacy_extract_nutrition_from_text(text), extract_nutrition_from_text(text)
+        print(f"{name}: {len(old)} -> {len(new)} fields  {new}")
+
+    texts = list(dumps.values())
+    total_bytes = sum(len(t) for t in texts)
+    for label, fn in [("legacy", legacy_extract_nutrition_from_text), ("single-pass", extract_nutrition_from_text)]:
+        seconds = min(timeit.repeat(lambda: [fn(t) for t in texts], number=args.repeat, repeat=3))
+        per_doc = seconds / (args.repeat * len(texts)) * 1e6
+        print(f"{label:>12}: {per_doc:8.1f} us/dump  {total_bytes * args.repeat / seconds / 1e6:6.2f} MB/s")
+
+    # Multi-page OCR: the panel sits after pages of prose. The legacy version
+    # lowercases and rescans the whole blob once per field.
+    prose = "Ingredients: potatoes, sunflower oil, salt. Store in a cool, dry place. " * 20 + "\n"
+    for pages in (1, 10, 100):
+        big = prose * pages + dumps["crisps.txt"]
+        timings = []
+        for fn in (legacy_extract_nutrition_from_text, extract_nutrition_from_text):
+            timings.append(min(timeit.repeat(lambda: fn(big), number=5, repeat=3)) / 5 * 1e3)
+        print(f"{len(big) // 1024:>5} KiB dump: legacy {timings[0]:7.2f} ms  single-pass {timings[1]:7.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,394 @@
+"""
+Benchmark suite for the rating pipeline, runnable offline.
+
+    python benchmarks/bench_pipeline.py [--sizes 1k,100k,1m] [--output results.json]
+    python benchmarks/bench_pipeline.py --compare benchmarks/results/<old>.json
+
+Covers normalize_ingredient(s), extract_nutrition_from_text, calculate_score
+(scalar) and calculate_scores (batched), DiskCache hit/miss, OCR with a
+stubbed tesseract, and barcode -> score latency through a local stub of the
+OFF API (fixtures/off) and through product stores of each catalog size.
+Before timing, the bulk barcode path (get_products_by_barcodes) is checked
+against the stub: plain lookups, a 429 with Retry-After and a persistent 503.
+Results are written as JSON; --compare reports changes against an earlier
+file and exits non-zero if anything regressed by more than --threshold.
+"""
+import argparse
+import http.server
+import io
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+FIXTURES = os.path.join(HERE, "fixtures")
+RESULTS_DIR = os.path.join(HERE, "results")
+SIZES = {"1k": 1_000, "10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+SCALAR_CAP = 100_000  # calculate_score is timed on at most this many rows per size
+ROUNDS = 5  # repeatable benchmarks report their fastest round
+NUTRIENT_SCALES = {  # synthetic catalog: exponential draws with these means, per 100 g
+    "energy_kcal": 250, "sugars_g": 12, "salt_g": 0.8, "fat_g": 12,
+    "saturated_fat_g": 4, "fiber_g": 2.5, "proteins_g": 7,
+}
+
+
+def load_off_fixtures() -> dict:
+    fixtures = {}
+    for name in sorted(os.listdir(os.path.join(FIXTURES, "off"))):
+        with open(os.path.join(FIXTURES, "off", name), encoding="utf-8") as f:
+            doc = json.load(f)
+        fixtures[doc["code"]] = doc
+    return fixtures
+
+
+def synthetic_product(code: str, templates: list) -> dict:
+    """Deterministic product for a synthetic barcode: a fixture with jittered nutriments."""
+    rng = random.Random(code)
+    template = templates[rng.randrange(len(templates))]["product"]
+    nutriments = {k: round(v * rng.uniform(0.5, 1.5), 3) for k, v in template["nutriments"].items()}
+    return dict(template, code=code, product_name=f"{template['product_name']} #{code[-6:]}", nutriments=nutriments)
+
+
+class StubOFFHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves /api/v0/product/<code>.json from the fixtures, or synthesizes one.
+    `faults` maps a code to error responses, (status, headers), served in
+    order before the product; `requests` counts GETs per code.
+    """
+    fixtures = {}
+    faults = {}
+    requests = {}
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # headers and body go out in separate writes
+
+    def do_GET(self):
+        match = re.match(r"/api/v0/product/(\d+)\.json", self.path)
+        if not match:
+            self.send_error(404)
+            return
+        code = match.group(1)
+        self.requests[code] = self.requests.get(code, 0) + 1
+        if self.faults.get(code):
+            status, headers = self.faults[code].pop(0)
+            self.send_response(status)
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        doc = self.fixtures.get(code) or {
+            "code": code, "status": 1,
+            "product": synthetic_product(code, list(self.fixtures.values())),
+        }
+        body = json.dumps(doc).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub_server() -> str:
+    StubOFFHandler.fixtures = load_off_fixtures()
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StubOFFHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def synthetic_catalog(n: int, seed: int = 0) -> dict:
+    """n products as columns: barcodes plus normalized nutrients."""
+    rng = np.random.default_rng(seed)
+    columns = {name: np.round(rng.exponential(scale, n), 2) for name, scale in NUTRIENT_SCALES.items()}
+    columns["code"] = np.char.add("2", np.char.zfill(np.arange(n).astype(str), 12))
+    return columns
+
+
+def timed(name: str, size, ops: int, fn, per_op=None, rounds: int = 1) -> dict:
+    """
+    Time fn() (ops operations in one go), or per_op over each item fn()
+    yields for latency percentiles. The fastest of `rounds` runs is kept;
+    stateful benchmarks (cold caches, inserts) must use one round.
+    """
+    result = {"name": name, "size": size, "ops": ops, "rounds": rounds}
+    best = None
+    for _ in range(rounds):
+        if per_op is None:
+            started = time.perf_counter()
+            fn()
+            seconds = time.perf_counter() - started
+            samples = None
+        else:
+            samples = np.empty(ops)
+            started = time.perf_counter()
+            for i, item in enumerate(fn()):
+                t0 = time.perf_counter_ns()
+                per_op(item)
+                samples[i] = time.perf_counter_ns() - t0
+            seconds = time.perf_counter() - started
+        if best is None or seconds < best[0]:
+            best = (seconds, samples)
+    seconds, samples = best
+    if samples is not None:
+        result["p50_us"] = round(float(np.percentile(samples, 50)) / 1e3, 2)
+        result["p99_us"] = round(float(np.percentile(samples, 99)) / 1e3, 2)
+    result["seconds"] = round(seconds, 4)
+    result["ops_per_s"] = round(ops / seconds, 1) if seconds else None
+    print(f"{name:<32}{str(size):>9}{ops:>10,}{result['ops_per_s'] or 0:>16,.0f} ops/s"
+          + (f"   p50 {result['p50_us']:>9.1f} µs  p99 {result['p99_us']:>9.1f} µs" if "p50_us" in result else ""))
+    return result
+
+
+def bench_text(results: list, repeat: int):
+    from normalize import normalize_ingredient, normalize_ingredients, extract_nutrition_from_text
+    with open(os.path.join(FIXTURES, "off_ingredients.txt"), encoding="utf-8") as f:
+        lines = [line for line in f.read().splitlines() if line.strip()]
+    tokens = [tok for line in lines for tok in re.split(r',|;|\n', line) if tok.strip()] * repeat
+    results.append(timed("normalize_ingredient", None, len(tokens), lambda: tokens, normalize_ingredient, rounds=ROUNDS))
+    texts = lines * repeat
+    results.append(timed("normalize_ingredients", None, len(texts), lambda: texts, normalize_ingredients, rounds=ROUNDS))
+    dumps = []
+    for name in sorted(os.listdir(os.path.join(FIXTURES, "ocr"))):
+        with open(os.path.join(FIXTURES, "ocr", name), encoding="utf-8") as f:
+            dumps.append(f.read())
+    dumps = dumps * repeat
+    results.append(timed("extract_nutrition_from_text", None, len(dumps), lambda: dumps, extract_nutrition_from_text, rounds=ROUNDS))
+
+
+def bench_cache(results: list, workdir: str, n: int = 20_000):
+    from cache import DiskCache
+    cache = DiskCache(os.path.join(workdir, "bench_cache.sqlite"), table="bench", max_entries=n * 2)
+    product = load_off_fixtures()["3017620422003"]["product"]
+    keys = [f"barcode:{i}" for i in range(n)]
+    results.append(timed("cache.set", None, n, lambda: keys, lambda k: cache.set(k, product)))
+    results.append(timed("cache.get_hit", None, n, lambda: keys, cache.get, rounds=ROUNDS))
+    missing = [f"barcode:missing{i}" for i in range(n)]
+    results.append(timed("cache.get_miss", None, n, lambda: missing, cache.get, rounds=ROUNDS))
+
+
+def bench_ocr(results: list, n: int = 200):
+    """OCR path with tesseract stubbed out: decode, preprocess and cache cost only."""
+    from PIL import Image, ImageDraw
+    import ocr
+    with open(os.path.join(FIXTURES, "ocr", "nutella.txt"), encoding="utf-8") as f:
+        label_text = f.read()
+    ocr.get_tesseract().image_to_string = lambda img, lang=None, **kwargs: label_text
+    images = []
+    for i in range(n):
+        img = Image.new("RGB", (1200, 900), (240, 240, 230))
+        ImageDraw.Draw(img).text((40, 40), f"label {i}\n{label_text}", fill=(20, 20, 20))
+        buffer = io.BytesIO()
+        img.save(buffer, "PNG")
+        images.append(buffer.getvalue())
+    results.append(timed("ocr_bytes.miss (stub tesseract)", None, n, lambda: images, ocr.ocr_bytes))
+    results.append(timed("ocr_bytes.hit", None, n, lambda: images, ocr.ocr_bytes, rounds=ROUNDS))
+
+
+def check_bulk(n: int = 200):
+    """get_products_by_barcodes against the stub: every lookup, Retry-After and a failing barcode."""
+    import acquire
+    acquire._product_store = None
+    cache = acquire.get_product_cache()
+    codes = [f"4{i:012d}" for i in range(n)]
+    throttled, broken = codes[0], codes[1]
+    StubOFFHandler.faults = {throttled: [(429, {"Retry-After": "1"})],
+                             broken: [(503, {})] * (acquire.HTTP_RETRIES + 1)}
+    StubOFFHandler.requests = {}
+    misses = cache.misses
+    started = time.perf_counter()
+    found = acquire.get_products_by_barcodes(codes + codes[:10], concurrency=8, rate_limit=None)
+    seconds = time.perf_counter() - started
+    problems = []
+    if set(found) != set(codes) - {broken}:
+        problems.append(f"expected {n - 1} products, got {len(found)} (failing barcode present: {broken in found})")
+    if any(not product or product.get("code") != code for code, product in found.items()):
+        problems.append("a product does not match its barcode")
+    if StubOFFHandler.requests.get(throttled) != 2 or seconds < 1:
+        problems.append(f"429 was not retried after Retry-After ({StubOFFHandler.requests.get(throttled)} requests, {seconds:.2f} s)")
+    if StubOFFHandler.requests.get(broken) != acquire.HTTP_RETRIES + 1:
+        problems.append(f"503 was tried {StubOFFHandler.requests.get(broken)} times, not {acquire.HTTP_RETRIES + 1}")
+    if cache.misses - misses != n:
+        problems.append(f"{cache.misses - misses} cache misses for {n} distinct barcodes")
+    StubOFFHandler.faults = {}
+    if problems:
+        print("bulk barcode check FAILED:\n  " + "\n  ".join(problems))
+        sys.exit(1)
+    print(f"bulk barcode check: {len(found)} of {n} barcodes in {seconds:.2f} s "
+          f"(429 retried after Retry-After, 503 given up after {acquire.HTTP_RETRIES} retries)")
+
+
+def bench_network(results: list, n: int):
+    """barcode -> score through the stub OFF server (cold), then from the lookup cache (warm)."""
+    import acquire
+    from normalize import normalize_nutrient_name
+    from score import calculate_score
+    acquire._product_store = None
+
+    def barcode_to_score(code):
+        product = acquire.get_product_by_barcode(code)
+        return calculate_score({k: (v or 0) for k, v in normalize_nutrient_name(product["nutriments"]).items()})
+
+    codes = list(StubOFFHandler.fixtures) + [f"3{i:012d}" for i in range(n - len(StubOFFHandler.fixtures))]
+    results.append(timed("e2e.barcode_network", None, len(codes), lambda: codes, barcode_to_score))
+    results.append(timed("e2e.barcode_cached", None, len(codes), lambda: codes, barcode_to_score, rounds=ROUNDS))
+
+
+def bench_catalog(results: list, label: str, n: int, workdir: str, e2e_samples: int):
+    import pandas as pd
+    import acquire
+    from normalize import normalize_ingredients, normalize_nutrient_name
+    from score import calculate_score, calculate_scores
+    from store import ProductStore, NUTRIENT_COLUMNS
+
+    catalog = synthetic_catalog(n)
+    frame = pd.DataFrame({k: v for k, v in catalog.items() if k != "code"})
+    results.append(timed("calculate_scores", label, n, lambda: calculate_scores(frame), rounds=ROUNDS))
+    rows = frame.head(SCALAR_CAP).to_dict("records")
+    results.append(timed("calculate_score", label, len(rows), lambda: rows, calculate_score, rounds=ROUNDS))
+
+    # Offline product store of n products, then barcode -> score against it.
+    templates = [doc["product"] for doc in StubOFFHandler.fixtures.values()]
+    ingredients = [normalize_ingredients(t["ingredients_text"]) for t in templates]
+    store_path = os.path.join(workdir, f"products_{label}.sqlite")
+    store = ProductStore(store_path)
+
+    def fill():
+        batch = []
+        for i, code in enumerate(catalog["code"]):
+            t = i % len(templates)
+            row = {col: catalog[col][i] for col in NUTRIENT_COLUMNS}
+            row.update(code=str(code), product_name=f"{templates[t]['product_name']} {i}",
+                       brands=templates[t]["brands"], lang="en", image_url="",
+                       ingredients_text=templates[t]["ingredients_text"], ingredients=ingredients[t],
+                       nutriments={"energy-kcal_100g": row["energy_kcal"], "sugars_100g": row["sugars_g"],
+                                   "salt_100g": row["salt_g"], "fat_100g": row["fat_g"],
+                                   "saturated-fat_100g": row["saturated_fat_g"],
+                                   "fiber_100g": row["fiber_g"], "proteins_100g": row["proteins_g"]})
+            batch.append(row)
+            if len(batch) == 10_000:
+                store.put_many(batch)
+                batch = []
+        store.put_many(batch)
+    results.append(timed("store.put_many", label, n, fill))
+
+    acquire._product_store = store
+    acquire.get_product_cache().clear()
+    sample = [str(code) for code in np.random.default_rng(1).choice(catalog["code"], min(n, e2e_samples), replace=False)]
+
+    def barcode_to_score(code):
+        product = acquire.get_product_by_barcode(code)
+        return calculate_score({k: (v or 0) for k, v in normalize_nutrient_name(product["nutriments"]).items()})
+    results.append(timed("e2e.barcode_store", label, len(sample), lambda: sample, barcode_to_score))
+    results.append(timed("store.search", label, 200, lambda: ["nut", "oat drink", "crisps 12", "ready salted"] * 50,
+                         lambda q: store.search(q, limit=10), rounds=ROUNDS))
+    acquire._product_store = None
+    store.close()
+    os.remove(store_path)
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    import pandas as pd
+    return {
+        "commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+    }
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> int:
+    """Print ops/s changes per benchmark; returns the number of regressions."""
+    old = {(r["name"], r["size"]): r for r in baseline["results"]}
+    regressions = 0
+    print(f"\nvs {baseline['environment'].get('commit') or 'baseline'} "
+          f"({baseline['environment'].get('timestamp', '')}):")
+    for r in current["results"]:
+        before = old.get((r["name"], r["size"]))
+        if not before or not before.get("ops_per_s") or not r.get("ops_per_s"):
+            continue
+        change = r["ops_per_s"] / before["ops_per_s"] - 1
+        flag = ""
+        if change < -threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        elif change > threshold:
+            flag = "  faster"
+        print(f"{r['name']:<32}{str(r['size']):>9}{before['ops_per_s']:>14,.0f} -> {r['ops_per_s']:>14,.0f}"
+              f"  {change:+7.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="1k,100k,1m", help=f"catalog sizes, from {', '.join(SIZES)}")
+    parser.add_argument("--repeat", type=int, default=20, help="passes over the text fixtures")
+    parser.add_argument("--e2e-samples", type=int, default=2000, help="barcode lookups timed per catalog")
+    parser.add_argument("--network-samples", type=int, default=300, help="lookups through the stub OFF server")
+    parser.add_argument("--output", help="results file (default: benchmarks/results/<time>-<commit>.json)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10, help="relative slowdown counted as a regression")
+    args = parser.parse_args()
+    sizes = [s.strip().lower() for s in args.sizes.split(",") if s.strip()]
+    unknown = [s for s in sizes if s not in SIZES]
+    if unknown:
+        parser.error(f"unknown sizes: {', '.join(unknown)}")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # Everything the pipeline touches lives in workdir and the stub server.
+        os.environ["FOOD_OFF_URL"] = start_stub_server()
+        os.environ["FOOD_CACHE_PATH"] = os.path.join(workdir, "openfoodfacts.sqlite")
+        os.environ["FOOD_CACHE_MAX_ENTRIES"] = str(max(10_000, args.network_samples * 2, args.e2e_samples * 2))
+        os.environ["FOOD_OCR_CACHE_PATH"] = os.path.join(workdir, "ocr.sqlite")
+        os.environ["FOOD_PRODUCT_STORE"] = os.path.join(workdir, "no-store.sqlite")
+        sys.path.insert(0, ROOT)
+
+        check_bulk()
+        results = []
+        bench_text(results, args.repeat)
+        bench_cache(results, workdir)
+        bench_ocr(results)
+        bench_network(results, args.network_samples)
+        for label in sizes:
+            bench_catalog(results, label, SIZES[label], workdir, args.e2e_samples)
+
+    report = {"environment": environment(), "results": results}
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        output = os.path.join(RESULTS_DIR, f"{stamp}-{report['environment']['commit'] or 'local'}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nresults written to {output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        if regressions:
+            print(f"{regressions} benchmark(s) regressed by more than {args.threshold:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Benchmark: vectorized calculate_scores versus a calculate_score loop, after
+checking that both give the same score, grade, band, drivers and evidence on
+random rows and on rows placed at every rule threshold. This is the parity
+test for calculate_scores; --check-only skips the timings, --rules all checks
+every rule version.
+
+    python benchmarks/bench_score.py [--rows 20000] [--rules v1|all] [--check-only]
+"""
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from rules import available_versions, load_rules, rules_path
+from score import calculate_score, calculate_scores
+
+MEANS = {"energy_kcal": 250, "sugars_g": 12, "added_sugars_g": 5, "saturated_fat_g": 4,
+         "salt_g": 0.8, "fiber_g": 2.5, "proteins_g": 7, "fruit_veg_pct": 40}
+LADDER_FIELDS = {"energy_kcal": "energy_kcal", "sugars_g": "sugars_g", "saturated_fat_g": "saturated_fat_g",
+                 "sodium_mg": "salt_g", "fiber_g": "fiber_g", "proteins_g": "proteins_g"}
+
+
+def random_rows(n: int, seed: int = 42) -> list:
+    rng = random.Random(seed)
+    return [dict({name: round(rng.expovariate(1 / mean), rng.choice((0, 1, 3)))
+                  for name, mean in MEANS.items()}, ultra_processed=rng.random() < 0.3)
+            for _ in range(n)]
+
+
+def boundary_rows(version: str) -> list:
+    """Each threshold of the rule file, exactly and one float step either side."""
+    with open(rules_path(version), encoding="utf-8") as f:
+        spec = json.load(f)
+    cutoffs = [(LADDER_FIELDS[name], t / 400 if name == "sodium_mg" else t)
+               for name, pairs in spec["ladders"].items() for t, _ in pairs]
+    cutoffs.append(("added_sugars_g", spec["added_sugars"]["above_g"]))
+    cutoffs += [("added_sugars_g", spec["added_sugars"]["above_g"] + k * spec["added_sugars"]["grams_per_point"])
+                for k in range(1, spec["added_sugars"]["max_points"] + 2)]
+    cutoffs += [("fruit_veg_pct", c) for c, _ in spec["fruit_veg"]]
+    rows = []
+    for field, value in cutoffs:
+        for v in (math.nextafter(value, -math.inf), float(value), math.nextafter(value, math.inf)):
+            rows.append({field: v})
+            rows.append(dict({name: float(mean) for name, mean in MEANS.items()}, **{field: v}))
+    return rows
+
+
+def check_parity(rows: list, ruleset) -> int:
+    """Rows where calculate_scores and calculate_score disagree (printed)."""
+    batch = calculate_scores(rows, explain=True, ruleset=ruleset).to_dict("records")
+    # The batch fills missing nutrients with 0.0, so give the scalar path the same floats.
+    filled = [dict({name: float(row.get(name, 0)) for name in MEANS}, ultra_processed=row.get("ultra_processed", False))
+              for row in rows]
+    mismatches = 0
+    for row, got in zip(filled, batch):
+        score, grade, band, drivers, evidence = calculate_score(row, ruleset)
+        expected = {"score": score, "grade": grade, "band": band, "drivers": drivers, "evidence": evidence}
+        got = dict(got, score=int(got["score"]))
+        if got != expected:
+            mismatches += 1
+            if mismatches <= 5:
+                print(f"differs: {row}\n  scalar {expected}\n  batch  {got}")
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=20_000, help="random rows to compare and time")
+    parser.add_argument("--rules", default=None, help="rules version, or all (default: FOOD_RULES_VERSION or v1)")
+    parser.add_argument("--check-only", action="store_true", help="run the parity check without timings")
+    args = parser.parse_args()
+
+    rows = random_rows(args.rows)
+    failed = False
+    for ruleset in map(load_rules, available_versions() if args.rules == "all" else [args.rules]):
+        edges = boundary_rows(ruleset.version)
+        mismatches = check_parity(rows, ruleset) + check_parity(edges, ruleset)
+        print(f"parity ({ruleset.version}): {mismatches} mismatches over {len(rows)} random + {len(edges)} boundary rows")
+        failed = failed or mismatches > 0
+    if failed:
+        sys.exit(1)
+    if args.check_only:
+        return
+
+    filled = [dict(row) for row in rows]
+    timings = {}
+    for label, run in [("scalar", lambda: [calculate_score(row, ruleset) for row in filled]),
+                       ("vectorized", lambda: calculate_scores(rows, ruleset=ruleset)),
+                       ("vectorized+explain", lambda: calculate_scores(rows, explain=True, ruleset=ruleset))]:
+        started = time.perf_counter()
+        run()
+        timings[label] = time.perf_counter() - started
+        print(f"{label:>18}: {len(rows) / timings[label]:>12,.0f} rows/s")
+    print(f"speedup: {timings['scalar'] / timings['vectorized']:.1f}x over {len(rows)} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Returned by DiskCache.get when a key is absent or expired. A cached None is a
+# negative entry (e.g. a barcode OpenFoodFacts doesn't know) and is a hit.
+MISSING = object()
+
+
+class DiskCache:
+    """
+    Persistent key/value cache backed by a single SQLite table.
+    Values are stored as JSON with an expiry time; the least recently used
+    entries are evicted once the table grows past `max_entries`.
+    """
+
+    def __init__(self, path: str, table: str = "entries", ttl: float = 24 * 3600,
+                 negative_ttl: float = 3600, max_entries: int = 10000):
+        self.path = path
+        self.table = table
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            "key TEXT PRIMARY KEY, value TEXT, expires REAL, accessed REAL)"
+        )
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_accessed ON {table}(accessed)")
+
+    def get(self, key: str):
+        """Return the cached value for key, or MISSING."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, expires FROM {self.table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or (row[1] is not None and row[1] < now):
+                self.misses += 1
+                return MISSING
+            self._conn.execute(f"UPDATE {self.table} SET accessed = ? WHERE key = ?", (now, key))
+            self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key: str, value, ttl: float = None):
+        """Store value under key. None values expire after negative_ttl."""
+        if ttl is None:
+            ttl = self.negative_ttl if value is None else self.ttl
+        now = time.time()
+        expires = now + ttl if ttl else None
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (key, value, expires, accessed) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), expires, now),
+            )
+            self._writes += 1
+            if self._writes % 100 == 0:
+                self._evict()
+
+    def delete(self, key: str):
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self.table}")
+            self.hits = self.misses = 0
+
+    def _evict(self):
+        # Drop expired rows first, then everything past max_entries by last access.
+        self._conn.execute(f"DELETE FROM {self.table} WHERE expires < ?", (time.time(),))
+        self._conn.execute(
+            f"DELETE FROM {self.table} WHERE key IN ("
+            f"SELECT key FROM {self.table} ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": size}
@@ -0,0 +1,312 @@
+"""
+Compact representation of normalized products.
+
+NormalizedProduct keeps only what scoring and the UI need:
+- the seven normalize_nutrient_name values, in a fixed-width float array
+- ingredients as integer ids into a shared, interned Vocabulary
+- the code, name, brand and image fields
+
+Catalog stores millions of products column-wise in NumPy arrays. It saves
+them as .npy files and loads them back memory-mapped. NumPy is imported by
+Catalog's methods, so callers that only need NormalizedProduct (the UI) skip it.
+
+    python catalog.py build --store data/products.sqlite --out data/catalog
+    python catalog.py info data/catalog
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import threading
+from array import array
+from normalize import SYNONYMS, normalize_ingredients, normalize_nutrient_name, product_ingredients_text
+from store import NUTRIENT_COLUMNS
+
+TEXT_FIELDS = ("product_name", "brands", "image_url")
+CATALOG_FORMAT = 1
+
+
+class Vocabulary:
+    """Interned ingredient terms <-> dense integer ids."""
+    __slots__ = ("_ids", "_terms", "_lock")
+
+    def __init__(self, terms=()):
+        self._ids = {}
+        self._terms = []
+        self._lock = threading.Lock()
+        for term in terms:
+            self.add(term)
+
+    def add(self, term: str) -> int:
+        """Id of `term`, assigning the next id if it is new."""
+        term_id = self._ids.get(term)
+        if term_id is None:
+            with self._lock:
+                term_id = self._ids.get(term)
+                if term_id is None:
+                    term = sys.intern(term)
+                    term_id = self._ids[term] = len(self._terms)
+                    self._terms.append(term)
+        return term_id
+
+    def get(self, term: str):
+        """Id of `term`, or None if it was never seen."""
+        return self._ids.get(term)
+
+    def term(self, term_id: int) -> str:
+        return self._terms[term_id]
+
+    def encode(self, terms) -> array:
+        return array("I", map(self.add, terms))
+
+    def decode(self, ids) -> list:
+        terms = self._terms
+        return [terms[i] for i in ids]
+
+    def to_list(self) -> list:
+        return list(self._terms)
+
+    def __len__(self):
+        return len(self._terms)
+
+    def __contains__(self, term):
+        return term in self._ids
+
+
+_vocabulary = None
+_vocabulary_lock = threading.Lock()
+
+
+def get_vocabulary() -> Vocabulary:
+    """Process-wide vocabulary, seeded with the standard terms from SYNONYMS."""
+    global _vocabulary
+    if _vocabulary is None:
+        with _vocabulary_lock:
+            if _vocabulary is None:
+                _vocabulary = Vocabulary(SYNONYMS)
+    return _vocabulary
+
+
+def _restore_product(code, product_name, brands, image_url, nutrients, ingredients):
+    vocabulary = get_vocabulary()
+    return NormalizedProduct(code, product_name, brands, image_url,
+                             array("d", nutrients), vocabulary.encode(ingredients), vocabulary)
+
+
+class NormalizedProduct:
+    """
+    One product, reduced to its scoring inputs and display fields. get()
+    mirrors dict access for the kept fields, so code written against OFF
+    product dicts (product.get("product_name", "")) works unchanged.
+    """
+    __slots__ = ("code", "product_name", "brands", "image_url", "nutrients", "ingredient_ids", "vocabulary")
+
+    def __init__(self, code, product_name, brands, image_url, nutrients, ingredient_ids, vocabulary=None):
+        self.code = code
+        self.product_name = product_name
+        self.brands = brands
+        self.image_url = image_url
+        self.nutrients = nutrients  # array("d"), NUTRIENT_COLUMNS order, NaN = missing
+        self.ingredient_ids = ingredient_ids  # array("I") of vocabulary ids
+        self.vocabulary = vocabulary or get_vocabulary()
+
+    @classmethod
+    def from_product(cls, product: dict, vocabulary: Vocabulary = None) -> "NormalizedProduct":
+        """Normalize an OFF product dict (or a product store row)."""
+        vocabulary = vocabulary or get_vocabulary()
+        nutrients = normalize_nutrient_name(product.get("nutriments") or {})
+        ingredients = product.get("ingredients_normalized")
+        if ingredients is None:
+            ingredients = normalize_ingredients(*product_ingredients_text(product))
+        return cls(
+            str(product.get("code") or ""),
+            product.get("product_name") or "",
+            product.get("brands") or "",
+            product.get("image_url") or "",
+            array("d", (math.nan if nutrients[col] is None else nutrients[col] for col in NUTRIENT_COLUMNS)),
+            vocabulary.encode(ingredients),
+            vocabulary,
+        )
+
+    @property
+    def ingredients(self) -> list:
+        return self.vocabulary.decode(self.ingredient_ids)
+
+    def nutrient_dict(self) -> dict:
+        """Nutrients as normalize_nutrient_name returns them (None for missing)."""
+        return {col: (None if math.isnan(v) else v) for col, v in zip(NUTRIENT_COLUMNS, self.nutrients)}
+
+    def get(self, key: str, default=None):
+        """Dict-style access to the kept text fields; empty counts as missing."""
+        if key in ("code", "product_name", "brands", "image_url"):
+            return getattr(self, key) or default
+        return default
+
+    def __reduce__(self):
+        # Ids only mean something within one vocabulary, so pickle the terms.
+        return (_restore_product, (self.code, self.product_name, self.brands, self.image_url,
+                                   self.nutrients.tobytes(), self.ingredients))
+
+    def __repr__(self):
+        return f"NormalizedProduct(code={self.code!r}, product_name={self.product_name!r})"
+
+
+class Catalog:
+    """
+    Column store of normalized products:
+      codes                  fixed-width bytes, one per product
+      nutrients              float64 (n, 7) in NUTRIENT_COLUMNS order, NaN = missing
+      ingredient_offsets/ids product i's ingredient ids are ids[offsets[i]:offsets[i+1]]
+      <field>_offsets/_data  UTF-8 text of product_name, brands and image_url
+    """
+
+    def __init__(self, columns: dict, vocabulary: Vocabulary):
+        self.columns = columns
+        self.vocabulary = vocabulary
+        self._code_order = None
+
+    @classmethod
+    def build(cls, products, vocabulary: Vocabulary = None) -> "Catalog":
+        """Build from an iterable of NormalizedProducts or OFF product dicts."""
+        import numpy as np
+        vocabulary = vocabulary or get_vocabulary()
+        codes = []
+        nutrients = array("d")
+        ingredient_offsets = array("q", [0])
+        ingredient_ids = array("I")
+        text_offsets = {field: array("q", [0]) for field in TEXT_FIELDS}
+        text_data = {field: bytearray() for field in TEXT_FIELDS}
+        for product in products:
+            if not isinstance(product, NormalizedProduct):
+                product = NormalizedProduct.from_product(product, vocabulary)
+            ids = product.ingredient_ids
+            if product.vocabulary is not vocabulary:
+                ids = vocabulary.encode(product.ingredients)
+            codes.append(product.code.encode("utf-8"))
+            nutrients.extend(product.nutrients)
+            ingredient_ids.extend(ids)
+            ingredient_offsets.append(len(ingredient_ids))
+            for field in TEXT_FIELDS:
+                text_data[field] += getattr(product, field).encode("utf-8")
+                text_offsets[field].append(len(text_data[field]))
+
+        width = max((len(code) for code in codes), default=1) or 1
+        columns = {
+            "codes": np.array(codes, dtype=f"S{width}"),
+            "nutrients": np.frombuffer(nutrients, dtype=np.float64).reshape(-1, len(NUTRIENT_COLUMNS)).copy(),
+            "ingredient_offsets": np.frombuffer(ingredient_offsets, dtype=np.int64).copy(),
+            "ingredient_ids": np.frombuffer(ingredient_ids, dtype=np.uint32).copy(),
+        }
+        for field in TEXT_FIELDS:
+            columns[f"{field}_offsets"] = np.frombuffer(text_offsets[field], dtype=np.int64).copy()
+            columns[f"{field}_data"] = np.frombuffer(bytes(text_data[field]), dtype=np.uint8).copy()
+        return cls(columns, vocabulary)
+
+    @classmethod
+    def from_store(cls, store, vocabulary: Vocabulary = None) -> "Catalog":
+        return cls.build(store.iter_products(), vocabulary)
+
+    def __len__(self):
+        return len(self.columns["codes"])
+
+    def _text(self, field: str, i: int) -> str:
+        offsets = self.columns[f"{field}_offsets"]
+        return bytes(self.columns[f"{field}_data"][offsets[i]:offsets[i + 1]]).decode("utf-8")
+
+    def code(self, i: int) -> str:
+        return self.columns["codes"][i].decode("utf-8")
+
+    def ingredient_ids(self, i: int) -> "np.ndarray":
+        offsets = self.columns["ingredient_offsets"]
+        return self.columns["ingredient_ids"][offsets[i]:offsets[i + 1]]
+
+    def ingredients(self, i: int) -> list:
+        return self.vocabulary.decode(self.ingredient_ids(i).tolist())
+
+    def __getitem__(self, i: int) -> NormalizedProduct:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return NormalizedProduct(self.code(i), self._text("product_name", i), self._text("brands", i),
+                                 self._text("image_url", i), array("d", self.columns["nutrients"][i]),
+                                 array("I", self.ingredient_ids(i).tolist()), self.vocabulary)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def find(self, code: str):
+        """Row index of a barcode, or None (binary search over a sorted code index)."""
+        import numpy as np
+        if self._code_order is None:
+            self._code_order = np.argsort(self.columns["codes"], kind="stable")
+        codes = self.columns["codes"]
+        encoded = code.encode("utf-8")
+        if len(encoded) > codes.dtype.itemsize:
+            return None  # casting to the column's width would truncate it onto another code
+        key = np.array(encoded, dtype=codes.dtype)
+        pos = np.searchsorted(codes, key, sorter=self._code_order)
+        if pos < len(codes) and codes[self._code_order[pos]] == key:
+            return int(self._code_order[pos])
+        return None
+
+    def get(self, code: str) -> NormalizedProduct:
+        i = self.find(code)
+        return None if i is None else self[i]
+
+    def nutrient_frame(self) -> "pd.DataFrame":
+        """Nutrients as a DataFrame with NUTRIENT_COLUMNS, ready for calculate_scores."""
+        import pandas as pd
+        return pd.DataFrame(self.columns["nutrients"], columns=list(NUTRIENT_COLUMNS), copy=False)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(column.nbytes for column in self.columns.values())
+
+    def save(self, directory: str):
+        """Write one .npy file per column plus the vocabulary."""
+        import numpy as np
+        os.makedirs(directory, exist_ok=True)
+        for name, column in self.columns.items():
+            np.save(os.path.join(directory, f"{name}.npy"), column)
+        with open(os.path.join(directory, "vocabulary.json"), "w", encoding="utf-8") as f:
+            json.dump(self.vocabulary.to_list(), f, ensure_ascii=False)
+        with open(os.path.join(directory, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"format": CATALOG_FORMAT, "products": len(self),
+                       "nutrients": list(NUTRIENT_COLUMNS), "columns": list(self.columns)}, f)
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> "Catalog":
+        """Load a saved catalog; with mmap the columns are paged in on demand."""
+        import numpy as np
+        with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("format") != CATALOG_FORMAT or meta.get("nutrients") != list(NUTRIENT_COLUMNS):
+            raise ValueError(f"{directory}: unsupported catalog format, rebuild it")
+        columns = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r" if mmap else None)
+                   for name in meta["columns"]}
+        with open(os.path.join(directory, "vocabulary.json"), encoding="utf-8") as f:
+            vocabulary = Vocabulary(json.load(f))
+        return cls(columns, vocabulary)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or inspect a columnar product catalog.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="build a catalog from the product store")
+    build.add_argument("--store", default=os.environ.get("FOOD_PRODUCT_STORE", "data/products.sqlite"))
+    build.add_argument("--out", default="data/catalog")
+    info = sub.add_parser("info", help="summarize a saved catalog")
+    info.add_argument("directory")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        from store import ProductStore
+        catalog = Catalog.from_store(ProductStore(args.store))
+        catalog.save(args.out)
+    else:
+        catalog = Catalog.load(args.directory)
+    print(json.dumps({"products": len(catalog), "vocabulary": len(catalog.vocabulary),
+                      "megabytes": round(catalog.nbytes / 1e6, 1)}))
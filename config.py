@@ -0,0 +1,61 @@
+"""
+Application settings, resolved once per process.
+
+Values come from, in increasing priority:
+- the defaults below
+- config.json next to this file (copy config_template.json; FOOD_CONFIG points elsewhere)
+- environment variables:
+  - FOOD_TESSERACT_PATH
+  - FOOD_OFF_URL
+  - FOOD_OCR_LANGUAGES (e.g. "eng+fra" or "eng,fra")
+"""
+import functools
+import json
+import logging
+import os
+
+CONFIG_PATH = os.environ.get("FOOD_CONFIG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json"))
+DEFAULTS = {
+    "tesseract_path": None,  # None: pytesseract's default, "tesseract" on PATH
+    "openfoodfacts_url": "https://world.openfoodfacts.org",
+    "ocr_languages": ["eng"],
+}
+_ENV = {
+    "tesseract_path": "FOOD_TESSERACT_PATH",
+    "openfoodfacts_url": "FOOD_OFF_URL",
+    "ocr_languages": "FOOD_OCR_LANGUAGES",
+}
+
+
+@functools.lru_cache(maxsize=None)
+def get_config() -> dict:
+    """Merged settings; read once, so later changes to the file or environment need a restart."""
+    config = dict(DEFAULTS)
+    if os.path.exists(CONFIG_PATH):
+        try:
+            with open(CONFIG_PATH, encoding="utf-8") as f:
+                config.update({k: v for k, v in json.load(f).items() if k in DEFAULTS})
+        except (OSError, ValueError) as e:
+            logging.warning(f"[CONFIG] Ignoring {CONFIG_PATH}: {e}")
+    for key, var in _ENV.items():
+        if os.environ.get(var):
+            config[key] = os.environ[var]
+    return config
+
+
+def tesseract_path():
+    return get_config()["tesseract_path"] or None
+
+
+def openfoodfacts_url() -> str:
+    """Base OFF URL. Older configs give the full ".../api/v0/product" endpoint; that suffix is dropped."""
+    url = get_config()["openfoodfacts_url"].rstrip("/")
+    return url[:-len("/api/v0/product")] if url.endswith("/api/v0/product") else url
+
+
+def ocr_languages() -> str:
+    """Tesseract language string, e.g. "eng+fra"."""
+    languages = get_config()["ocr_languages"]
+    if isinstance(languages, str):
+        languages = languages.replace(",", "+").split("+")
+    return "+".join(lang.strip() for lang in languages if lang.strip()) or "eng"
@@ -0,0 +1,134 @@
+"""
+Stream an Open Food Facts dump into the local product store.
+
+    python ingest.py openfoodfacts-products.jsonl.gz [--store data/products.sqlite]
+
+Accepts the JSONL export or the tab-separated CSV export, plain or gzipped.
+Records are read one at a time and written in batches, so memory stays
+bounded by --batch-size. Progress is checkpointed with each batch and an
+interrupted import picks up where it stopped unless --restart is given. A
+finished import, or a dump replaced since (new size or mtime), starts over.
+"""
+import argparse
+import csv
+import gzip
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+from normalize import normalize_ingredients, normalize_nutrient_name, product_ingredients_text
+from store import ProductStore, NUTRIMENT_FIELDS
+
+DEFAULT_STORE_PATH = os.environ.get("FOOD_PRODUCT_STORE", "data/products.sqlite")
+
+
+def _open_text(path: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace", newline="")
+    return open(path, "r", encoding="utf-8", errors="replace", newline="")
+
+
+def iter_dump(path: str, skip: int = 0):
+    """
+    Yield OFF records as dicts from a JSONL or CSV dump, lazily.
+    The first `skip` records are passed over without being parsed.
+    """
+    with _open_text(path) as f:
+        if ".csv" in os.path.basename(path) or ".tsv" in os.path.basename(path):
+            csv.field_size_limit(sys.maxsize)
+            reader = csv.reader(f, delimiter="\t", quoting=csv.QUOTE_NONE)
+            header = next(reader)
+            for values in itertools.islice(reader, skip, None):
+                yield dict(zip(header, values))
+        else:
+            for line in itertools.islice(f, skip, None):
+                line = line.strip()
+                if not line:
+                    yield None
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    yield None
+
+
+def record_to_row(record: dict) -> dict:
+    """Normalize one OFF record into a ProductStore row, or None if it has no barcode."""
+    code = (record.get("code") or "").strip()
+    if not code:
+        return None
+    # JSONL nests nutriments; the CSV export has them as top-level columns.
+    source = record.get("nutriments") if isinstance(record.get("nutriments"), dict) else record
+    nutriments = {k: source[k] for k in NUTRIMENT_FIELDS if source.get(k) not in (None, "")}
+    # Prefer the ingredient list in the product's own language (ingredients_text_fr, ...).
+    ingredients_text, lang = product_ingredients_text(record)
+    row = {
+        "code": code,
+        "product_name": record.get("product_name") or "",
+        "brands": record.get("brands") or "",
+        "lang": record.get("lang") or record.get("lc") or "",
+        "image_url": record.get("image_url") or "",
+        "ingredients_text": ingredients_text,
+        "ingredients": normalize_ingredients(ingredients_text, lang),
+        "nutriments": nutriments,
+    }
+    row.update(normalize_nutrient_name(nutriments))
+    return row
+
+
+def import_dump(path: str, store: ProductStore, batch_size: int = 5000,
+                restart: bool = False, progress_every: int = 100000) -> dict:
+    """
+    Import a dump into `store`, resuming from the last checkpoint if that
+    import was interrupted and the file is unchanged (same size and mtime).
+    Returns counts of records read, products written and the rows/s rate.
+    """
+    checkpoint_key = f"import:{os.path.abspath(path)}"
+    stat = os.stat(path)
+    source = {"size": stat.st_size, "mtime": stat.st_mtime}
+    checkpoint = {} if restart else store.get_meta(checkpoint_key, {})
+    resumable = not checkpoint.get("complete") and checkpoint.get("source") == source
+    done = checkpoint.get("records", 0) if resumable else 0
+    if done:
+        logging.info(f"[INGEST] Resuming {path} after {done} records")
+
+    started = time.perf_counter()
+    read = written = 0
+    batch = []
+    for record in iter_dump(path, skip=done):
+        read += 1
+        row = record_to_row(record) if isinstance(record, dict) else None
+        if row:
+            batch.append(row)
+        if read % batch_size == 0:
+            store.put_many(batch, meta={checkpoint_key: {"records": done + read, "source": source}})
+            written += len(batch)
+            batch = []
+        if read % progress_every == 0:
+            rate = read / (time.perf_counter() - started)
+            logging.info(f"[INGEST] {done + read} records, {rate:,.0f} rows/s")
+            print(f"{done + read:>12,} records  {rate:>10,.0f} rows/s", file=sys.stderr)
+    store.put_many(batch, meta={checkpoint_key: {"records": done + read, "source": source,
+                                                 "complete": True}})
+    written += len(batch)
+
+    elapsed = time.perf_counter() - started
+    stats = {"records": done + read, "read": read, "written": written,
+             "seconds": round(elapsed, 2), "rows_per_s": round(read / elapsed, 1) if elapsed else 0.0}
+    logging.info(f"[INGEST] Import finished: {stats}")
+    return stats
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    parser = argparse.ArgumentParser(description="Import an Open Food Facts dump into the local product store.")
+    parser.add_argument("dump", help="OFF JSONL or CSV export (.gz supported)")
+    parser.add_argument("--store", default=DEFAULT_STORE_PATH, help="SQLite product store path")
+    parser.add_argument("--batch-size", type=int, default=5000, help="records per transaction/checkpoint")
+    parser.add_argument("--restart", action="store_true", help="ignore any checkpoint and start over")
+    args = parser.parse_args()
+
+    stats = import_dump(args.dump, ProductStore(args.store), batch_size=args.batch_size, restart=args.restart)
+    print(json.dumps(stats))
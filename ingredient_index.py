@@ -0,0 +1,287 @@
+"""
+Inverted index from canonical ingredient terms to products.
+
+Each term maps to a sorted uint32 array of product ids (catalog row numbers;
+products added later get the following ids). Queries combine terms with
+AND / OR / NOT and can filter on grade:
+
+    wheat AND NOT milk AND grade <= B
+    (egg OR milk) AND NOT "trans fat"
+
+Query terms go through normalize_ingredient, so "whey protein" finds milk.
+Each product is also posted under the standard terms found inside its
+ingredients, so "milk powder" and "milk chocolate" are found under milk.
+Postings are expanded into boolean masks over all products for evaluation,
+which keeps every query linear in the catalog size (milliseconds for
+millions of products) however common its terms are.
+
+    python ingredient_index.py data/catalog "wheat AND NOT milk AND grade <= B"
+"""
+import argparse
+import json
+import re
+import threading
+import time
+from array import array
+import numpy as np
+from catalog import Catalog, NormalizedProduct
+from normalize import canonical_terms, normalize_ingredient
+
+_QUERY_TOKEN_RE = re.compile(r'\(|\)|"[^"]*"|<=|>=|≤|≥|[<>=]|[^\s()"<>=≤≥]+')
+_KEYWORDS = {"AND", "OR", "NOT"}
+_COMPARATORS = {"<": np.less, "<=": np.less_equal, "≤": np.less_equal, "=": np.equal,
+                ">": np.greater, ">=": np.greater_equal, "≥": np.greater_equal}
+NO_GRADE = 0  # grades are stored as the byte value of their letter; 0 = not scored
+
+
+class IngredientIndex:
+    """Term -> sorted product ids over a Catalog, updatable one product at a time."""
+
+    def __init__(self, catalog: Catalog, postings: dict = None, grades: np.ndarray = None):
+        self.catalog = catalog
+        self.vocabulary = catalog.vocabulary
+        self._postings = postings or {}  # term id -> sorted uint32 array
+        self._added = {}  # term id -> ids to merge into the postings on next read
+        self._removed = {}  # term id -> ids to drop from the postings on next read
+        self._grades = array("B", bytes(len(catalog)) if grades is None else np.asarray(grades, dtype=np.uint8).tobytes())
+        self._extra_codes = []  # codes of products added after the catalog was built
+        self._extra_ids = {}  # code -> id for those products
+        self._extra_terms = {}  # id -> term ids, for products added or replaced via add()
+        self._canonical = {}  # term id -> ids of the standard terms it contains, besides itself
+        self._lock = threading.RLock()
+
+    @classmethod
+    def build(cls, catalog: Catalog, ruleset=None) -> "IngredientIndex":
+        """Index every catalog product, with grades under `ruleset` (default rules)."""
+        from score import calculate_scores
+        offsets = np.asarray(catalog.columns["ingredient_offsets"])
+        term_ids = np.asarray(catalog.columns["ingredient_ids"])
+        product_ids = np.repeat(np.arange(len(catalog), dtype=np.uint32), np.diff(offsets))
+        # Stable sort by term keeps product ids ascending within each term.
+        order = np.argsort(term_ids, kind="stable")
+        term_ids, product_ids = term_ids[order], product_ids[order]
+        keep = np.ones(len(term_ids), dtype=bool)
+        keep[1:] = (term_ids[1:] != term_ids[:-1]) | (product_ids[1:] != product_ids[:-1])
+        term_ids, product_ids = term_ids[keep], product_ids[keep]
+        starts = np.flatnonzero(np.r_[True, term_ids[1:] != term_ids[:-1]]) if len(term_ids) else np.array([], dtype=int)
+        ends = np.r_[starts[1:], len(term_ids)]
+        postings = {int(term_ids[s]): product_ids[s:e] for s, e in zip(starts, ends)}
+
+        grades = calculate_scores(catalog.nutrient_frame(), ruleset=ruleset)["grade"]
+        grade_bytes = np.frombuffer("".join(grades).encode("ascii"), dtype=np.uint8) if len(grades) else None
+        index = cls(catalog, postings, grade_bytes)
+
+        # Post products under the standard terms inside their ingredients too.
+        contained = {}
+        for term_id in list(index._postings):
+            for canonical_id in index._canonical_ids(term_id):
+                contained.setdefault(canonical_id, []).append(index._postings[term_id])
+        for canonical_id, arrays in contained.items():
+            arrays.append(index._postings.get(canonical_id, np.empty(0, dtype=np.uint32)))
+            index._postings[canonical_id] = np.unique(np.concatenate(arrays)).astype(np.uint32)
+        return index
+
+    def __len__(self):
+        return len(self._grades)
+
+    def _code_id(self, code: str):
+        product_id = self._extra_ids.get(code)
+        return product_id if product_id is not None else self.catalog.find(code)
+
+    def _canonical_ids(self, term_id: int) -> tuple:
+        ids = self._canonical.get(term_id)
+        if ids is None:
+            term = self.vocabulary.term(term_id)
+            ids = self._canonical[term_id] = tuple(
+                self.vocabulary.add(canonical) for canonical in canonical_terms(term) if canonical != term)
+        return ids
+
+    def _expand(self, term_ids) -> list:
+        """Sorted term ids plus the standard terms they contain."""
+        expanded = set(term_ids)
+        for term_id in term_ids:
+            expanded.update(self._canonical_ids(term_id))
+        return sorted(expanded)
+
+    def _term_ids(self, product_id: int):
+        if product_id in self._extra_terms:
+            return self._extra_terms[product_id]
+        if product_id < len(self.catalog):
+            return self._expand(self.catalog.ingredient_ids(product_id).tolist())
+        return ()
+
+    def add(self, product: NormalizedProduct, grade: str = None) -> int:
+        """
+        Index a newly normalized product, or re-index one already present
+        (matched by barcode). Returns its product id.
+        """
+        new_terms = self._expand(set(map(self.vocabulary.add, product.ingredients)))
+        with self._lock:
+            product_id = self._code_id(product.code) if product.code else None
+            if product_id is None:
+                product_id = len(self._grades)
+                self._grades.append(NO_GRADE)
+                self._extra_codes.append(product.code)
+                if product.code:
+                    self._extra_ids[product.code] = product_id
+                old_terms = set()
+            else:
+                old_terms = set(self._term_ids(product_id))
+            for term_id in old_terms.difference(new_terms):
+                self._removed.setdefault(term_id, set()).add(product_id)
+                self._added.get(term_id, set()).discard(product_id)
+            for term_id in set(new_terms).difference(old_terms):
+                self._added.setdefault(term_id, set()).add(product_id)
+                self._removed.get(term_id, set()).discard(product_id)
+            self._extra_terms[product_id] = new_terms
+            if grade is not None:
+                self._grades[product_id] = ord(grade)
+        return product_id
+
+    def set_grade(self, product_id: int, grade: str):
+        """Record a product's grade after (re)scoring; None clears it."""
+        with self._lock:
+            self._grades[product_id] = ord(grade) if grade else NO_GRADE
+
+    def postings(self, term: str) -> np.ndarray:
+        """Sorted ids of products containing the canonical `term`."""
+        term_id = self.vocabulary.get(term)
+        if term_id is None:
+            return np.empty(0, dtype=np.uint32)
+        with self._lock:
+            base = self._postings.get(term_id, np.empty(0, dtype=np.uint32))
+            added, removed = self._added.pop(term_id, None), self._removed.pop(term_id, None)
+            if added or removed:
+                if removed:
+                    base = base[~np.isin(base, np.fromiter(removed, dtype=np.uint32))]
+                if added:
+                    base = np.union1d(base, np.fromiter(added, dtype=np.uint32)).astype(np.uint32)
+                self._postings[term_id] = base
+            return base
+
+    def count(self, term: str) -> int:
+        return len(self.postings(term))
+
+    def grades(self) -> np.ndarray:
+        # A copy: a live view would stop add() from growing the array.
+        with self._lock:
+            return np.frombuffer(self._grades, dtype=np.uint8).copy()
+
+    def code(self, product_id: int) -> str:
+        if product_id < len(self.catalog):
+            return self.catalog.code(product_id)
+        return self._extra_codes[product_id - len(self.catalog)]
+
+    def query(self, expression: str) -> np.ndarray:
+        """Sorted ids of the products matching a query expression."""
+        return np.flatnonzero(_QueryParser(self, expression).parse()).astype(np.uint32)
+
+    def search(self, expression: str, limit: int = None) -> list:
+        """Barcodes of the products matching a query expression."""
+        ids = self.query(expression)
+        return [self.code(int(i)) for i in ids[:limit]]
+
+
+class _QueryParser:
+    """Recursive descent over the query tokens, producing a boolean mask per node."""
+
+    def __init__(self, index: IngredientIndex, expression: str):
+        self.index = index
+        self.size = len(index)
+        self.tokens = _QUERY_TOKEN_RE.findall(expression)
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else None
+
+    def keyword(self, word: str) -> bool:
+        token = self.peek()
+        if token is not None and token.upper() == word:
+            self.pos += 1
+            return True
+        return False
+
+    def parse(self) -> np.ndarray:
+        if not self.tokens:
+            raise ValueError("empty query")
+        mask = self.parse_or()
+        if self.peek() is not None:
+            raise ValueError(f"unexpected {self.peek()!r} in query")
+        return mask
+
+    def parse_or(self):
+        mask = self.parse_and()
+        while self.keyword("OR"):
+            mask = mask | self.parse_and()
+        return mask
+
+    def parse_and(self):
+        mask = self.parse_not()
+        while self.keyword("AND"):
+            mask = mask & self.parse_not()
+        return mask
+
+    def parse_not(self):
+        if self.keyword("NOT"):
+            return ~self.parse_not()
+        return self.parse_atom()
+
+    def parse_atom(self):
+        token = self.peek()
+        if token is None:
+            raise ValueError("query ends early")
+        if token == "(":
+            self.pos += 1
+            mask = self.parse_or()
+            if self.peek() != ")":
+                raise ValueError("missing ')' in query")
+            self.pos += 1
+            return mask
+        if token.lower() == "grade" and self.pos + 1 < len(self.tokens) and self.tokens[self.pos + 1] in _COMPARATORS:
+            return self.parse_grade()
+        if token.startswith('"'):
+            self.pos += 1
+            return self.term_mask(token.strip('"'))
+        words = []
+        while self.peek() is not None and self.peek() not in ("(", ")") and self.peek().upper() not in _KEYWORDS:
+            if self.peek() in _COMPARATORS:
+                raise ValueError(f"unexpected {self.peek()!r} in query")
+            words.append(self.tokens[self.pos])
+            self.pos += 1
+        if not words:
+            raise ValueError(f"expected an ingredient, got {token!r}")
+        return self.term_mask(" ".join(words))
+
+    def parse_grade(self):
+        op = _COMPARATORS[self.tokens[self.pos + 1]]
+        self.pos += 2
+        grade = self.peek()
+        if grade is None or len(grade) != 1:
+            raise ValueError("grade comparison needs a single-letter grade")
+        self.pos += 1
+        grades = self.index.grades()
+        return (grades != NO_GRADE) & op(grades, ord(grade.upper()))
+
+    def term_mask(self, text: str):
+        mask = np.zeros(self.size, dtype=bool)
+        ids = self.index.postings(normalize_ingredient(text))
+        mask[ids[ids < self.size]] = True  # ignore products added mid-query
+        return mask
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query a saved catalog by ingredient and grade.")
+    parser.add_argument("catalog", help="catalog directory (see catalog.py build)")
+    parser.add_argument("query", help='e.g. "wheat AND NOT milk AND grade <= B"')
+    parser.add_argument("--rules", help="rules version for grades (default: FOOD_RULES_VERSION or v1)")
+    parser.add_argument("--limit", type=int, default=20, help="barcodes to print")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    index = IngredientIndex.build(Catalog.load(args.catalog), ruleset=args.rules)
+    built = time.perf_counter()
+    ids = index.query(args.query)
+    queried = time.perf_counter()
+    print(json.dumps({"matches": len(ids), "build_ms": round((built - started) * 1000, 1),
+                      "query_ms": round((queried - built) * 1000, 2),
+                      "codes": [index.code(int(i)) for i in ids[:args.limit]]}))
@@ -1,5 +1,12 @@
+import codecs
+import functools
+import json
+import os
 import re
-from acquire import get_product_by_barcode, extract_text_from_image_url, search_product_name
+import unicodedata
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+from tracing import traced
 
 SYNONYMS = {
     "salt":      ["sodium chloride", "sea salt", "table salt", "salt"],
@@ -11,22 +18,276 @@ SYNONYMS = {
     "egg":       ["egg white", "egg yolk", "albumen", "egg"],
 }
 
-def normalize_ingredient(ingredient: str) -> str:
-    """Lowercase, remove punctuation, replace synonyms with standard terms."""
-    ingredient = ingredient.lower()
-    ingredient = re.sub(r'[^\w\s]', '', ingredient)
-    for standard, variants in SYNONYMS.items():
+# Other languages' synonym tables live in synonyms/<lc>.json (same shape as
+# SYNONYMS, mapping to the same English standard terms). A table is read and
+# compiled the first time its language is seen.
+SYNONYMS_DIR = os.environ.get("FOOD_SYNONYMS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "synonyms"))
+DEFAULT_LANG = "en"
+_LANG_RE = re.compile(r'[a-z]{2,3}')
+_MOJIBAKE_MARKERS = ("Ã", "Â", "Å", "â€")  # UTF-8 text that was decoded as Latin-1 / CP1252
+_LIGATURES = str.maketrans({"œ": "oe", "Œ": "OE", "æ": "ae", "Æ": "AE", "ß": "ss"})
+
+def fold_text(text: str) -> str:
+    """
+    Repair UTF-8 mojibake ("Ã©" -> "é"), apply Unicode compatibility
+    normalization and strip accents ("lait écrémé" -> "lait ecreme").
+    ASCII text is returned unchanged.
+    """
+    if text.isascii():
+        return text
+    if any(marker in text for marker in _MOJIBAKE_MARKERS):
+        for encoding in ("cp1252", "latin-1"):
+            try:
+                text = text.encode(encoding).decode("utf-8")
+                break
+            except UnicodeError:
+                continue
+    text = unicodedata.normalize("NFKD", text.translate(_LIGATURES))
+    return unicodedata.normalize("NFC", "".join(ch for ch in text if not unicodedata.combining(ch)))
+
+def language_code(lang) -> str:
+    """Two/three-letter language code from OFF's lang/lc ("fr", "fr_FR", "de-CH"); default "en"."""
+    match = _LANG_RE.match((lang or "").strip().lower())
+    return match.group() if match else DEFAULT_LANG
+
+@functools.lru_cache(maxsize=None)
+def load_synonyms(lang: str) -> dict:
+    """Synonym table for a language code; {} when there is no synonyms/<lang>.json."""
+    if lang == DEFAULT_LANG:
+        return SYNONYMS
+    try:
+        with open(os.path.join(SYNONYMS_DIR, f"{lang}.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+_PUNCTUATION_RE = re.compile(r'[^\w\s�]')
+_MAX_SYNONYM_PASSES = 4
+
+def build_synonym_matcher(synonyms: dict):
+    """
+    Compile a synonym table into one whole-word regex plus a variant -> standard
+    lookup. Variants are tried longest first, so "brown sugar" wins over "sugar".
+    Variants are folded like the text they are matched against; accented ones
+    also match with U+FFFD in place of each accent ("lait �cr�m�").
+    """
+    lookup = {}
+    for standard, variants in synonyms.items():
         for var in variants:
-            pattern = r'\b' + re.escape(var) + r'\b'
-            ingredient = re.sub(pattern, standard, ingredient)
+            var = unicodedata.normalize("NFC", var.lower())
+            lookup.setdefault(_PUNCTUATION_RE.sub('', fold_text(var)), standard)
+            if not var.isascii():
+                lookup.setdefault(_PUNCTUATION_RE.sub('', "".join(
+                    ch if ch.isascii() else "�" for ch in var.translate(_LIGATURES))), standard)
+    alternation = "|".join(re.escape(var) for var in sorted(lookup, key=len, reverse=True))
+    return re.compile(r'(?<!\w)(?:' + alternation + r')(?!\w)'), lookup
+
+@functools.lru_cache(maxsize=None)
+def _language_matcher(lang: str):
+    # The language's own variants win; English ones still apply (labels often mix them).
+    merged = {}
+    for table in (load_synonyms(lang), SYNONYMS):
+        for standard, variants in table.items():
+            merged.setdefault(standard, []).extend(variants)
+    pattern, lookup = build_synonym_matcher(merged)
+    return pattern, lambda match: lookup[match.group()]
+
+@functools.lru_cache(maxsize=256)
+def get_synonym_matcher(lang=None):
+    """(compiled pattern, replacement function) for an OFF lang/lc value."""
+    return _language_matcher(language_code(lang))
+
+def normalize_ingredient(ingredient: str, lang: str = None) -> str:
+    """Fold accents, lowercase, remove punctuation, replace synonyms with standard terms."""
+    return _apply_synonyms(ingredient, get_synonym_matcher(lang))
+
+def _apply_synonyms(ingredient: str, matcher) -> str:
+    pattern, replace = matcher
+    ingredient = _PUNCTUATION_RE.sub('', fold_text(ingredient).lower())
+    # A rewrite can expose a longer synonym ("hydrogenated vegetable oil" ->
+    # "hydrogenated fat" -> "trans fat"), so repeat until nothing changes.
+    for _ in range(_MAX_SYNONYM_PASSES):
+        rewritten = pattern.sub(replace, ingredient)
+        if rewritten == ingredient:
+            break
+        ingredient = rewritten
     return ingredient.strip()
 
-def normalize_ingredients(ingredients_text: str) -> list:
-    """Splits a string and normalizes all ingredient tokens."""
-    tokens = re.split(r',|;|\n', ingredients_text)
-    result = [normalize_ingredient(tok) for tok in tokens if tok.strip()]
-    return list(dict.fromkeys(result))
+# Zero-width, so overlapping terms are all found: "trans fat" gives trans fat and fat.
+_CANONICAL_RE = re.compile(r'(?<!\w)(?=(' + "|".join(
+    re.escape(term) for term in sorted(SYNONYMS, key=len, reverse=True)) + r')(?!\w))')
+
+def canonical_terms(ingredient: str) -> list:
+    """Standard SYNONYMS terms inside a normalized ingredient ("milk powder" -> ["milk"])."""
+    return list(dict.fromkeys(match.group(1) for match in _CANONICAL_RE.finditer(ingredient)))
+
+def product_ingredients_text(product: dict):
+    """
+    (ingredients text, language code) for an OFF product: the text in the
+    product's own language (ingredients_text_<lang>) when OFF has it, else
+    ingredients_text, else the first non-empty ingredients_text_<lc>.
+    """
+    lang = language_code(product.get("lang") or product.get("lc"))
+    text = product.get(f"ingredients_text_{lang}") or product.get("ingredients_text")
+    if text:
+        return text, lang
+    for key, value in product.items():
+        if key.startswith("ingredients_text_") and value and isinstance(value, str):
+            return value, language_code(key[len("ingredients_text_"):])
+    return "", lang
+
+class Ingredient(NamedTuple):
+    """One entry of an ingredient list: canonical name, declared %, enclosing ingredient."""
+    name: str
+    percent: Optional[float] = None
+    parent: Optional[str] = None
+
+# Streaming ingredient-list reader. Text arrives in chunks (a string, a
+# file-like object or any iterable of str/bytes); one pass over the structural
+# characters splits items on , ; and newlines, nests "(...)" / "[...]" groups
+# as sub-ingredients and keeps decimal commas ("8,7%") inside their item.
+_STRUCTURE_RE = re.compile(r'[,;\n()\[\]]')
+_PERCENT_RE = re.compile(r'<?\s*(\d+(?:[.,]\d+)?)\s*%')
+READ_CHUNK_CHARS = 1 << 16
+MAX_INGREDIENT_CHARS = 1024  # text without any separator is cut after this many chars
+MAX_GROUP_ITEMS = 256  # an unclosed "(" is given up on after this many buffered items
+INGREDIENT_DEDUPE_WINDOW = 4096  # distinct names remembered for de-duplication
+
+def _iter_text_chunks(source):
+    if isinstance(source, (str, bytes)):
+        source = (source,)
+    elif hasattr(source, "read"):
+        read = source.read
+        source = iter(lambda: read(READ_CHUNK_CHARS), read(0))
+    decoder = None
+    for chunk in source:
+        if isinstance(chunk, bytes):
+            decoder = decoder or codecs.getincrementaldecoder("utf-8")(errors="replace")
+            chunk = decoder.decode(chunk)
+        yield chunk
+
+def _iter_segments(chunks):
+    """(text, delimiter) pairs; the last pair has delimiter None."""
+    carry = ""
+    for chunk in chunks:
+        text = carry + chunk if carry else chunk
+        start = 0
+        for match in _STRUCTURE_RE.finditer(text):
+            i = match.start()
+            delimiter = match.group()
+            if delimiter == ",":
+                if i + 1 == len(text):
+                    break  # can't tell "8," from "8,7" until the next chunk
+                if text[i - 1:i].isdigit() and text[i + 1].isdigit():
+                    continue
+            yield text[start:i], delimiter
+            start = i + 1
+        carry = text[start:]
+        if len(carry) > MAX_INGREDIENT_CHARS:
+            yield carry, ","
+            carry = ""
+    yield carry, None
+
+def _finish_item(level, matcher):
+    """Close the item being read at one bracket level, appending (name, percent, sub-items)."""
+    texts, children, items = level
+    if not texts and not children:
+        return
+    name, percent = "", None
+    if texts:
+        raw = texts[0] if len(texts) == 1 else " ".join(texts)
+        if "%" in raw:
+            match = _PERCENT_RE.search(raw)
+            if match:
+                percent = float(match.group(1).replace(",", "."))
+                raw = raw[:match.start()] + " " + raw[match.end():]
+        name = _apply_synonyms(raw, matcher)
+    if children:
+        for child in children:  # "(13%)" is the parent's percentage, not a sub-ingredient
+            if not child[0] and child[1] is not None and percent is None:
+                percent = child[1]
+        children = [child for child in children if child[0] or child[2]]
+    if name or children or percent is not None:
+        items.append((name, percent, children))
+    level[0], level[1] = [], []
+
+def _flatten(item, parent, out: list):
+    name, percent, children = item
+    if name:
+        out.append(Ingredient(name, percent, parent))
+    for child in children:
+        _flatten(child, name or parent, out)
+
+def iter_ingredient_parts(source, lang: str = None, dedupe_window: int = INGREDIENT_DEDUPE_WINDOW):
+    """
+    Lazily yield Ingredient tuples from an ingredient list, parents before
+    their sub-ingredients. "hazelnuts (13%)" and "hazelnuts 13%" both give
+    Ingredient("hazelnuts", 13.0); "minerals (calcium carbonate, ...)" gives
+    "minerals" then its parts with parent="minerals". `lang` (OFF lang/lc)
+    picks the synonym table. Repeated names are skipped; only the last
+    `dedupe_window` distinct names are remembered.
+    """
+    matcher = get_synonym_matcher(lang)
+    seen = OrderedDict()
+    # One level per open bracket: [texts of the current item, its sub-items, finished items].
+    stack = [[[], [], []]]
+    root_items = stack[0][2]
+
+    def close_group():
+        _finish_item(stack[-1], matcher)
+        stack[-2][1].extend(stack.pop()[2])
+
+    def ready():
+        out = []
+        for item in root_items:
+            _flatten(item, None, out)
+        root_items.clear()
+        fresh = []
+        for ingredient in out:
+            if ingredient.name in seen:
+                seen.move_to_end(ingredient.name)
+                continue
+            seen[ingredient.name] = None
+            if len(seen) > dedupe_window:
+                seen.popitem(last=False)
+            fresh.append(ingredient)
+        return fresh
 
+    for text, delimiter in _iter_segments(_iter_text_chunks(source)):
+        if text and not text.isspace():
+            stack[-1][0].append(text)
+        if delimiter == "(" or delimiter == "[":
+            stack.append([[], [], []])
+        elif delimiter == ")" or delimiter == "]":
+            if len(stack) > 1:
+                close_group()
+        elif delimiter is not None:
+            _finish_item(stack[-1], matcher)
+            if len(stack) > 1 and sum(len(level[2]) for level in stack) > MAX_GROUP_ITEMS:
+                while len(stack) > 1:
+                    close_group()
+        if root_items and len(stack) == 1:
+            yield from ready()
+    while len(stack) > 1:
+        close_group()
+    _finish_item(stack[0], matcher)
+    yield from ready()
+
+def iter_ingredients(source, lang: str = None, dedupe_window: int = INGREDIENT_DEDUPE_WINDOW):
+    """Lazily yield canonical ingredient names (see iter_ingredient_parts)."""
+    for ingredient in iter_ingredient_parts(source, lang, dedupe_window):
+        yield ingredient.name
+
+@traced("normalize.ingredients")
+def normalize_ingredients(ingredients_text, lang: str = None) -> list:
+    """
+    Canonical ingredient names of a list, de-duplicated, in order. Accepts a
+    string, a file-like object or an iterable of text chunks; `lang` picks the
+    synonym table (English by default).
+    """
+    return list(iter_ingredients(ingredients_text, lang))
+
+@traced("normalize.nutrients")
 def normalize_nutrient_name(nutrient: dict) -> dict:
     """Standardizes nutrient data and casts to float where possible."""
     def safe_float(value):
@@ -43,27 +304,165 @@ def normalize_nutrient_name(nutrient: dict) -> dict:
         "fiber_g": safe_float(nutrient.get("fiber_100g")),
         "proteins_g": safe_float(nutrient.get("proteins_100g")),
     }
+# Nutrition label scanner. One compiled pattern splits the lowercased OCR text
+# into words, numbers, "%", "/" and line breaks in a single pass; a small
+# per-line state machine then reads column headers and pairs nutrient labels
+# with values in either order ("Fat 12.3 g" or "12.3g fat").
+_NUTRITION_TOKEN_RE = re.compile(r"[a-zµ][\w-]*|\d+(?:[.,]\d+)?|[\n%/]")
+_LABEL_WORDS = {
+    "energy": "energy", "calories": "energy",
+    "fat": "fat_g",
+    "saturates": "saturated_fat_g", "saturated": "saturated_fat_g", "sat": "saturated_fat_g",
+    "carbohydrate": "carbohydrate_g", "carbohydrates": "carbohydrate_g", "carbs": "carbohydrate_g",
+    "sugar": "sugars_g", "sugars": "sugars_g",
+    "fibre": "fiber_g", "fiber": "fiber_g",
+    "protein": "proteins_g", "proteins": "proteins_g",
+    "salt": "salt_g",
+    "sodium": "sodium_g",
+    # Labels whose values belong to no reported field.
+    "monounsaturates": None, "mono-unsaturates": None, "monounsaturated": None,
+    "polyunsaturates": None, "poly-unsaturates": None, "polyunsaturated": None,
+    "unsaturates": None, "unsaturated": None, "trans": None,
+}
+# Label words that swallow a following "fat" ("saturated fat", "trans fat").
+_FAT_QUALIFIERS = {"saturated", "sat", "trans", "monounsaturated", "polyunsaturated", "unsaturated"}
+_UNITS = {"g": "g", "mg": "mg", "mcg": "mcg", "µg": "mcg", "ml": "ml", "%": "%",
+          "kcal": "kcal", "cal": "kcal", "calories": "kcal", "kj": "kj"}
+_SERVING_WORDS = {"serving", "portion", "pack", "bag", "bar", "biscuit", "slice", "cup"}
+_UNIT_SCALE = {"mg": 1e-3, "mcg": 1e-6}
+_KJ_PER_KCAL = 4.184
+
+
+def _pick_column(count: int, columns: list):
+    """Index, basis and confidence for a row of `count` values under header `columns`."""
+    if "per_100g" in columns and columns.index("per_100g") < count:
+        # A short row under a wider header may not line up with its columns.
+        return columns.index("per_100g"), "per_100g", (0.95 if count >= len(columns) else 0.75)
+    basis = columns[0] if columns else "unknown"
+    return 0, basis, (0.8 if count == 1 else 0.6)
+
+
+@traced("normalize.nutrition_text")
+def parse_nutrition_text(raw_text: str) -> dict:
+    """
+    Scan OCR text of a nutrition label in one pass.
+    Returns {field: {"value", "confidence", "basis"}} where basis is
+    "per_100g", "per_serving" or "unknown". When a label has several value
+    columns the per-100g column is preferred; kJ energy is converted to kcal
+    and sodium to salt when they are the best evidence available.
+    """
+    found = {}
+    columns = []
+
+    def record(field, value, confidence, basis):
+        if field not in found or confidence > found[field]["confidence"]:
+            found[field] = {"value": value, "confidence": round(confidence, 2), "basis": basis}
+
+    # Per-line state: header columns, label rows, value-first values awaiting
+    # a label, and energy values (kcal/kJ units identify them without a label).
+    header, rows, dangling, energy = [], [], [], {"kcal": [], "kj": []}
+    pending = None
+    value_first = False
+
+    def flush_line():
+        nonlocal columns
+        line_columns = header or columns
+        for field, values, after_value in rows:
+            if not values or field is None:
+                continue
+            if field == "energy":
+                energy["kcal"].extend(num for num, unit in values if unit is None)
+                continue
+            idx, basis, confidence = _pick_column(len(values), line_columns)
+            num, unit = values[idx]
+            if after_value:
+                confidence = min(confidence, 0.7)
+            if unit is None:
+                confidence *= 0.8
+            record(field, num * _UNIT_SCALE.get(unit, 1.0), confidence, basis)
+        for unit, values in energy.items():
+            if values:
+                idx, basis, confidence = _pick_column(len(values), line_columns)
+                record(f"energy_{unit}", values[idx], confidence, basis)
+        if header:
+            columns = list(header)
+
+    tokens = _NUTRITION_TOKEN_RE.findall(raw_text.lower())
+    tokens.append("\n")
+    n = len(tokens)
+    i = 0
+    prev = None
+    while i < n:
+        tok = tokens[i]
+        nxt = tokens[i + 1] if i + 1 < n else ""
+        i += 1
+        if tok == "\n":
+            flush_line()
+            header, rows, dangling, energy = [], [], [], {"kcal": [], "kj": []}
+            pending, value_first, prev = None, False, None
+            continue
+        if tok[0].isdigit():
+            unit = _UNITS.get(nxt)
+            if unit:
+                i += 1
+            num = float(tok.replace(",", "."))
+            if unit == "kcal" or unit == "kj":
+                energy[unit].append(num)
+            elif unit in ("%", "ml"):
+                pass
+            elif pending is not None and not value_first:
+                pending[1].append((num, unit))
+            else:
+                dangling.append((num, unit))
+            prev = tok
+            continue
+        if tok == "per" or tok == "/":
+            after = tokens[i + 1] if i + 1 < n else ""
+            if nxt == "100" and after in ("g", "ml"):
+                header.append("per_100g")
+                i += 2
+            elif nxt in _SERVING_WORDS:
+                header.append("per_serving")
+                i += 1
+            elif tok == "per" and nxt[:1].isdigit() and after[:1] in ("g", "m"):
+                header.append("per_serving")
+                i += 2
+            prev = tok
+            continue
+        if tok in _LABEL_WORDS and not (tok == "fat" and prev in _FAT_QUALIFIERS):
+            field = _LABEL_WORDS[tok]
+            if dangling:
+                # "8.5g fat": the value just before the label belongs to it, and
+                # the rest of the line is read the same way.
+                rows.append((field, dangling[-1:], True))
+                dangling, pending, value_first = [], None, True
+            else:
+                pending = (field, [], False)
+                rows.append(pending)
+        prev = tok
+
+    energy_kj = found.pop("energy_kj", None)
+    if energy_kj:
+        # Wins over a printed kcal figure only if that one is less certain,
+        # e.g. a lone per-serving kcal next to a per-100g kJ column.
+        record("energy_kcal", round(energy_kj["value"] / _KJ_PER_KCAL, 1),
+               energy_kj["confidence"] * 0.9, energy_kj["basis"])
+    sodium = found.pop("sodium_g", None)
+    if "salt_g" not in found and sodium:
+        record("salt_g", round(sodium["value"] * 2.5, 3), sodium["confidence"] * 0.9, sodium["basis"])
+    return found
+
+
 def extract_nutrition_from_text(raw_text: str) -> dict:
     """
-    Extract common nutrition fields from raw OCR text (very basic example).
+    Extract common nutrition fields from raw OCR text.
+    Returns {field: value}; see parse_nutrition_text for confidences.
     """
-    res = {}
-    if m := re.search(r"(\d+)\s*(kcal|cal)", raw_text.lower()):
-        res["energy_kcal"] = float(m.group(1))
-    if m := re.search(r"(\d+\.?\d*)\s*g\s*fat", raw_text.lower()):
-        res["fat_g"] = float(m.group(1))
-    if m := re.search(r"(\d+\.?\d*)\s*g\s*saturat", raw_text.lower()):
-        res["saturated_fat_g"] = float(m.group(1))
-    if m := re.search(r"(\d+\.?\d*)\s*g\s*carbohydrate", raw_text.lower()):
-        res["carbohydrate_g"] = float(m.group(1))
-    if m := re.search(r"(\d+\.?\d*)\s*g\s*sugars?", raw_text.lower()):
-        res["sugars_g"] = float(m.group(1))
-    if m := re.search(r"(\d+\.?\d*)\s*g\s*fiber", raw_text.lower()):
-        res["fiber_g"] = float(m.group(1))
-    if m := re.search(r"(\d+\.?\d*)\s*g\s*salt", raw_text.lower()):
-        res["salt_g"] = float(m.group(1))
-    return res
+    return {field: item["value"] for field, item in parse_nutrition_text(raw_text).items()}
+
+
 if __name__ == "__main__":
+    from acquire import get_product_by_barcode, extract_text_from_image_url, search_product_name
     print("Packaged Food Normalization System")
     print("Pick input source:\n1. Barcode\n2. Product name\n3. Image URL (OCR)\n4. Manual ingredients")
     mode = input("Select mode (1/2/3/4): ").strip()
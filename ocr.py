@@ -0,0 +1,217 @@
+import hashlib
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from io import BytesIO
+import numpy as np
+from cache import DiskCache, MISSING
+from config import ocr_languages, tesseract_path
+from tracing import span, traced, annotate
+
+# PIL and pytesseract (which drags in pandas) are imported on first OCR, not
+# with this module, so importing the pipeline stays cheap for callers that
+# never read an image.
+_tesseract = None
+_tesseract_lock = threading.Lock()
+
+# Preprocessing defaults, tuned for label photos.
+OCR_LANG = ocr_languages()
+CONTRAST_FACTOR = 2.0
+THRESHOLD = 128
+MAX_OCR_SIDE = 2500  # longer side in pixels; bigger images are downscaled first
+
+# OCR results keyed by image content hash + preprocessing settings, and the
+# last seen hash/ETag/Last-Modified per image URL. Entries never expire; the
+# tables are LRU-bounded.
+OCR_CACHE_PATH = os.environ.get("FOOD_OCR_CACHE_PATH", "cache/ocr.sqlite")
+OCR_CACHE_MAX_ENTRIES = int(os.environ.get("FOOD_OCR_CACHE_MAX_ENTRIES", 50000))
+_ocr_caches = None
+
+
+class OCRCancelled(Exception):
+    """Raised at the next checkpoint after an OCR job's cancel event is set."""
+
+
+def _check_cancelled(cancel):
+    if cancel is not None and cancel.is_set():
+        raise OCRCancelled()
+
+
+def get_tesseract():
+    """pytesseract, imported and pointed at the configured tesseract binary on first use."""
+    global _tesseract
+    with _tesseract_lock:
+        if _tesseract is None:
+            import pytesseract
+            if tesseract_path():
+                pytesseract.pytesseract.tesseract_cmd = tesseract_path()
+            _tesseract = pytesseract
+    return _tesseract
+
+
+def preprocess_image(img: "Image.Image", contrast: float = CONTRAST_FACTOR,
+                     threshold: int = THRESHOLD, max_side: int = MAX_OCR_SIDE) -> "Image.Image":
+    """
+    Grayscale, downscale, boost contrast, sharpen and binarize an image for OCR.
+    Same steps as ImageEnhance.Contrast + ImageFilter.SHARPEN + point(), done
+    as whole-array NumPy operations instead of a Python call per pixel value.
+    """
+    from PIL import Image
+    img = img.convert("L")
+    if max(img.size) > max_side:
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+    a = np.asarray(img, dtype=np.float32)
+
+    # Contrast: stretch around the mean grey level.
+    mean = int(a.mean() + 0.5)
+    a = np.rint(np.clip(mean + contrast * (a - mean), 0, 255))
+
+    # Sharpen: PIL's SHARPEN kernel (32 centre, -2 neighbours, /16); borders kept.
+    if a.shape[0] > 2 and a.shape[1] > 2:
+        h, w = a.shape
+        box = sum(a[i:h - 2 + i, j:w - 2 + j] for i in range(3) for j in range(3))
+        centre = a[1:-1, 1:-1]
+        a[1:-1, 1:-1] = np.rint(np.clip((34 * centre - 2 * box) / 16, 0, 255))
+
+    return Image.fromarray(np.where(a > threshold, 255, 0).astype(np.uint8), mode="L")
+
+
+def get_ocr_caches():
+    """(text cache, url cache), opened on first use in each process."""
+    global _ocr_caches
+    # SQLite connections must not cross a fork into pool workers.
+    if _ocr_caches is None or _ocr_caches[0] != os.getpid():
+        text_cache = DiskCache(OCR_CACHE_PATH, table="ocr_text", ttl=0,
+                               max_entries=OCR_CACHE_MAX_ENTRIES)
+        url_cache = DiskCache(OCR_CACHE_PATH, table="ocr_urls", ttl=0,
+                              max_entries=OCR_CACHE_MAX_ENTRIES)
+        _ocr_caches = (os.getpid(), text_cache, url_cache)
+    return _ocr_caches[1:]
+
+
+@traced("ocr.image")
+def ocr_bytes(data: bytes, lang: str = OCR_LANG, preprocess: bool = True) -> str:
+    """
+    OCR encoded image bytes, reusing a cached result when the same image was
+    already read with the same language and preprocessing settings.
+    """
+    return _ocr_digest(hashlib.sha256(data).hexdigest(), data, lang, preprocess)
+
+
+def _ocr_key(digest: str, lang: str, preprocess: bool) -> str:
+    settings = f"{CONTRAST_FACTOR}:{THRESHOLD}:{MAX_OCR_SIDE}" if preprocess else "raw"
+    return f"{digest}:{lang}:{settings}"
+
+
+def _ocr_digest(digest: str, data: bytes, lang: str, preprocess: bool, cancel=None) -> str:
+    text_cache, _ = get_ocr_caches()
+    key = _ocr_key(digest, lang, preprocess)
+    text = text_cache.get(key)
+    annotate(cached=text is not MISSING)
+    if text is MISSING:
+        _check_cancelled(cancel)
+        from PIL import Image
+        with span("ocr.decode", bytes=len(data)) as decode:
+            img = Image.open(BytesIO(data))
+            img.load()
+            decode.set(size=f"{img.width}x{img.height}")
+        if preprocess:
+            _check_cancelled(cancel)
+            with span("ocr.preprocess"):
+                img = preprocess_image(img)
+        _check_cancelled(cancel)
+        with span("ocr.tesseract", lang=lang):
+            text = get_tesseract().image_to_string(img, lang=lang).strip()
+        text_cache.set(key, text)
+    return text
+
+
+@traced("ocr.url")
+def ocr_url(url: str, lang: str = OCR_LANG, cancel=None) -> str:
+    """
+    OCR an image URL. A URL seen before is revalidated with its ETag /
+    Last-Modified; on 304 Not Modified the cached text is returned without
+    downloading the image again. Changed or new images are hashed, so the
+    same picture behind another URL still skips tesseract. Setting the
+    optional `cancel` threading.Event stops the job with OCRCancelled at the
+    next step boundary (download, decode, preprocess, tesseract).
+    """
+    from acquire import get_session, REQUEST_TIMEOUT  # per-process session in pool workers
+    text_cache, url_cache = get_ocr_caches()
+    session = get_session()
+
+    seen = url_cache.get(url)
+    headers = {}
+    if seen is not MISSING:
+        if seen.get("etag"):
+            headers["If-None-Match"] = seen["etag"]
+        if seen.get("last_modified"):
+            headers["If-Modified-Since"] = seen["last_modified"]
+    with span("http.fetch", url=url, conditional=bool(headers)) as fetch:
+        response = session.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+        fetch.set(status=response.status_code)
+    if response.status_code == 304:
+        text = text_cache.get(_ocr_key(seen["hash"], lang, True))
+        if text is not MISSING:
+            annotate(cached=True)
+            return text
+        _check_cancelled(cancel)
+        with span("http.fetch", url=url):
+            response = session.get(url, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+
+    data = response.content
+    digest = hashlib.sha256(data).hexdigest()
+    url_cache.set(url, {
+        "hash": digest,
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+    })
+    return _ocr_digest(digest, data, lang, True, cancel)
+
+
+def ocr_file(path: str, lang: str = OCR_LANG, preprocess: bool = True) -> str:
+    """OCR a local image file through the content-addressed cache."""
+    with open(path, "rb") as f:
+        return ocr_bytes(f.read(), lang=lang, preprocess=preprocess)
+
+
+def ocr_source(source: str, lang: str = OCR_LANG) -> str:
+    """OCR an image URL or local path with preprocessing, using the cache."""
+    if source.startswith(("http://", "https://")):
+        return ocr_url(source, lang)
+    return ocr_file(source, lang)
+
+
+def _ocr_worker(source: str, lang: str):
+    # Errors go back as text: some (e.g. TesseractNotFoundError) can't be
+    # unpickled in the parent and would break the whole pool.
+    try:
+        return ocr_source(source, lang), None
+    except Exception as e:
+        return "", f"{type(e).__name__}: {e}"
+
+
+def extract_text_batch(sources, workers: int = None, lang: str = OCR_LANG):
+    """
+    OCR many image URLs/paths across a process pool (one worker per core by
+    default). Yields (source, text, error) tuples as each image finishes, so
+    results stream back out of order; error is None or a message.
+    """
+    workers = workers or os.cpu_count() or 1
+    sources = iter(sources)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Keep a bounded window in flight so huge backlogs aren't queued up front.
+        pending = {}
+        for source in sources:
+            pending[pool.submit(_ocr_worker, source, lang)] = source
+            if len(pending) >= workers * 2:
+                break
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                source = pending.pop(future)
+                yield (source,) + future.result()
+                next_source = next(sources, None)
+                if next_source is not None:
+                    pending[pool.submit(_ocr_worker, next_source, lang)] = next_source
@@ -0,0 +1,212 @@
+"""
+Versioned scoring rules.
+
+Each rules/<version>.json file holds the nutrient ladders, the added-sugar and
+ultra-processed penalties, the fruit/veg bonus, the 0-100 normalization and
+the band cutoffs. A file is compiled once into ascending threshold tables
+(bisect lists for single products; NumPy arrays for batches, built on the
+first batch call so scalar scoring never imports NumPy) and recompiled
+when its mtime changes, so long-running workers pick up tuned rules without
+a restart. Any number of versions can be loaded side by side.
+"""
+import bisect
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+RULES_DIR = os.environ.get("FOOD_RULES_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "rules"))
+DEFAULT_RULES_VERSION = os.environ.get("FOOD_RULES_VERSION", "v1")
+RELOAD_CHECK_INTERVAL = 1.0  # seconds between mtime checks of a loaded rule file
+
+# Ladder names as used by calculate_score; sodium is in mg (salt_g * 400).
+LADDER_NAMES = ("energy_kcal", "sugars_g", "saturated_fat_g", "sodium_mg", "fiber_g", "proteins_g")
+
+_lock = threading.Lock()
+_loaded = {}  # version -> [Ruleset, mtime_ns, last checked (monotonic)]
+
+
+class Ruleset:
+    """One rule file, compiled for fast threshold lookups."""
+
+    def __init__(self, spec: dict, source: str = None):
+        self.source = source
+        self.version = str(spec.get("version") or os.path.splitext(os.path.basename(source or ""))[0])
+        self.description = spec.get("description", "")
+        # Identifies the exact rules, so edits to a version's file are detectable.
+        self.fingerprint = hashlib.sha256(json.dumps(spec, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+        try:
+            self._ladders = {}
+            self._tables = None  # NumPy arrays, see _arrays()
+            for name in LADDER_NAMES:
+                # File order is (threshold, points), highest threshold first.
+                pairs = sorted((t, int(p)) for t, p in spec["ladders"][name])
+                thresholds = [t for t, _ in pairs]
+                if not all(isinstance(t, (int, float)) for t in thresholds):
+                    raise ValueError(f"non-numeric threshold in ladder {name!r}")
+                if len(set(thresholds)) != len(thresholds):
+                    raise ValueError(f"duplicate thresholds in ladder {name!r}")
+                self._ladders[name] = (thresholds, [p for _, p in pairs])
+
+            added = spec["added_sugars"]
+            self.added_sugars_above = added["above_g"]
+            self.added_sugars_per_point = added["grams_per_point"]
+            self.added_sugars_max = int(added["max_points"])
+            self.ultra_processed_points = int(spec["ultra_processed_points"])
+            self.fruit_veg = sorted(((c, int(p)) for c, p in spec["fruit_veg"]), reverse=True)
+            self.offset = spec["normalization"]["offset"]
+            self.scale = spec["normalization"]["scale"]
+
+            bands = sorted((int(c), str(b), str(g)) for c, b, g in spec["bands"])
+            if not bands or bands[0][0] != 0:
+                raise ValueError("bands must start at score 0")
+            self.bands = bands
+            self._band_cutoffs = [c for c, _, _ in bands[1:]]
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"{source or 'rules'}: malformed rule file ({type(e).__name__}: {e})") from None
+
+    def ladder(self, name: str, value):
+        """(points, threshold exceeded) for one value; (0, None) below every threshold."""
+        thresholds, points = self._ladders[name]
+        # bisect_left counts thresholds strictly below value, i.e. `value > threshold`.
+        k = bisect.bisect_left(thresholds, value)
+        return (points[k - 1], thresholds[k - 1]) if k else (0, None)
+
+    def _arrays(self) -> dict:
+        """The NumPy threshold tables, built on first use (racing threads build identical copies)."""
+        if self._tables is None:
+            import numpy as np
+            tables = {name: (np.array(thresholds, dtype=float), np.array([0] + points, dtype=np.int64))
+                      for name, (thresholds, points) in self._ladders.items()}
+            tables["bands"] = (np.array(self._band_cutoffs),
+                               np.array([b for _, b, _ in self.bands], dtype=object),
+                               np.array([g for _, _, g in self.bands], dtype=object))
+            self._tables = tables
+        return self._tables
+
+    def ladder_points(self, name: str, values: "np.ndarray") -> "np.ndarray":
+        """Vectorized ladder(): points for each value."""
+        import numpy as np
+        thresholds, points = self._arrays()[name]
+        return points[np.searchsorted(thresholds, values, side="left")]
+
+    def ladder_exceeded(self, name: str, values: "np.ndarray"):
+        """Vectorized ladder() thresholds: (row indices over a threshold, the threshold each exceeded)."""
+        import numpy as np
+        thresholds, _ = self._ladders[name]
+        k = np.searchsorted(self._arrays()[name][0], values, side="left")
+        rows = np.flatnonzero(k)
+        return rows, [thresholds[i - 1] for i in k[rows].tolist()]
+
+    def normalize(self, score_raw):
+        return int(100 - ((score_raw + self.offset) * self.scale))
+
+    def band(self, score_norm: int):
+        """(band, grade) for a 0-100 score."""
+        _, band, grade = self.bands[bisect.bisect_right(self._band_cutoffs, score_norm)]
+        return band, grade
+
+    def bands_for(self, scores: "np.ndarray"):
+        """Vectorized band(): (band names, grades) arrays."""
+        import numpy as np
+        cutoffs, names, grades = self._arrays()["bands"]
+        idx = np.searchsorted(cutoffs, scores, side="right")
+        return names[idx], grades[idx]
+
+    def __repr__(self):
+        return f"Ruleset({self.version!r}, source={self.source!r})"
+
+
+def compile_rules(path: str) -> Ruleset:
+    with open(path, encoding="utf-8") as f:
+        try:
+            spec = json.load(f)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"{path}: invalid JSON ({e})") from None
+    return Ruleset(spec, source=path)
+
+
+def rules_path(version: str) -> str:
+    return os.path.join(RULES_DIR, f"{version}.json")
+
+
+def available_versions() -> list:
+    if not os.path.isdir(RULES_DIR):
+        return []
+    return sorted(name[:-5] for name in os.listdir(RULES_DIR) if name.endswith(".json"))
+
+
+def load_rules(version: str = None) -> Ruleset:
+    """
+    The compiled ruleset for `version` (default FOOD_RULES_VERSION / "v1").
+    The file's mtime is rechecked at most every RELOAD_CHECK_INTERVAL seconds;
+    if an edited file fails to compile, the previous rules stay in use.
+    """
+    version = version or DEFAULT_RULES_VERSION
+    entry = _loaded.get(version)
+    now = time.monotonic()
+    if entry is not None and now - entry[2] < RELOAD_CHECK_INTERVAL:
+        return entry[0]
+
+    path = rules_path(version)
+    with _lock:
+        entry = _loaded.get(version)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            if entry is None:
+                raise ValueError(f"unknown rules version {version!r} "
+                                 f"(available: {', '.join(available_versions()) or 'none'})") from None
+            entry[2] = now
+            return entry[0]
+        if entry is None:
+            entry = _loaded[version] = [compile_rules(path), mtime, now]
+            return entry[0]
+        if mtime != entry[1]:
+            try:
+                entry[0] = compile_rules(path)
+                logging.info(f"[RULES] Reloaded {entry[0].version} from {path}")
+            except (OSError, ValueError) as e:
+                logging.error(f"[RULES] Keeping previous {entry[0].version} rules: {e}")
+            entry[1] = mtime
+        entry[2] = now
+        return entry[0]
+
+
+def resolve_rules(ruleset=None) -> Ruleset:
+    """Accept a Ruleset, a version name, or None for the default version."""
+    if isinstance(ruleset, Ruleset):
+        return ruleset
+    return load_rules(ruleset)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Validate rule files or compare versions on the product store.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    check = sub.add_parser("check", help="compile a rule file and report errors")
+    check.add_argument("path")
+    compare = sub.add_parser("compare", help="grade changes between two versions over the product store")
+    compare.add_argument("versions", nargs=2)
+    compare.add_argument("--store", default=os.environ.get("FOOD_PRODUCT_STORE", "data/products.sqlite"))
+    args = parser.parse_args()
+
+    if args.command == "check":
+        ruleset = compile_rules(args.path)
+        print(f"{ruleset.version}: OK ({', '.join(LADDER_NAMES)}; bands {[b for _, b, _ in ruleset.bands]})")
+    else:
+        import sqlite3
+        import pandas as pd
+        from score import compare_rulesets
+        from store import NUTRIENT_COLUMNS
+        with sqlite3.connect(args.store) as conn:
+            frame = pd.read_sql(f"SELECT code, {', '.join(NUTRIENT_COLUMNS)} FROM products", conn, index_col="code")
+        # Pass names, not Rulesets: under `python rules.py` this module is __main__.
+        scored = compare_rulesets(frame, args.versions)
+        grade_a, grade_b = [column for column in scored.columns if column.startswith("grade_")]
+        shifts = pd.crosstab(scored[grade_a], scored[grade_b])
+        changed = (scored[grade_a] != scored[grade_b]).sum()
+        print(f"{len(scored)} products, {changed} change grade ({changed / max(len(scored), 1):.1%})")
+        print(shifts.to_string())
@@ -1,10 +1,21 @@
+from rules import resolve_rules
+from tracing import traced
 
-def calculate_score(nutrients):
+# Numeric inputs read by calculate_score / calculate_scores (plus the ultra_processed flag).
+SCORED_NUTRIENTS = ("energy_kcal", "sugars_g", "added_sugars_g", "saturated_fat_g",
+                    "salt_g", "fiber_g", "proteins_g", "fruit_veg_pct")
+
+
+@traced("score")
+def calculate_score(nutrients, ruleset=None):
     """
     Computes an advanced health score:
     - Normalized 0-100 scale (easier for users).
     - Also maps to Nutri-Score A-E for familiarity.
+    Thresholds, penalties and bands come from `ruleset` (a Ruleset or a
+    version name; default: the current rules/<FOOD_RULES_VERSION>.json).
     """
+    rules = resolve_rules(ruleset)
 
     score_raw = 0
     drivers = []
@@ -26,101 +37,223 @@ def calculate_score(nutrients):
 
     # --- NEGATIVE POINTS ---
     # Energy
-    for threshold, pts in [(3350, 10), (3015, 9), (2680, 8), (2345, 7), (2010, 6),
-                           (1675, 5), (1340, 4), (1005, 3), (670, 2), (335, 1)]:
-        if energy > threshold:
-            neg_points += pts
-            drivers.append(f"Very high energy: {energy} kcal/100g")
-            evidence.append(f"Energy > {threshold} kcal/100g")
-            break
+    pts, threshold = rules.ladder("energy_kcal", energy)
+    if threshold is not None:
+        neg_points += pts
+        drivers.append(f"Very high energy: {energy} kcal/100g")
+        evidence.append(f"Energy > {threshold} kcal/100g")
 
     # Total sugars
-    for threshold, pts in [(45, 10), (40, 9), (36, 8), (31, 7), (27, 6),
-                           (22.5, 5), (18, 4), (13.5, 3), (9, 2), (4.5, 1)]:
-        if sugars > threshold:
-            neg_points += pts
-            drivers.append(f"High sugar content: {sugars} g/100g")
-            evidence.append(f"Sugars > {threshold} g/100g")
-            break
+    pts, threshold = rules.ladder("sugars_g", sugars)
+    if threshold is not None:
+        neg_points += pts
+        drivers.append(f"High sugar content: {sugars} g/100g")
+        evidence.append(f"Sugars > {threshold} g/100g")
 
     # Added sugars – stronger penalty
-    if added_sugars > 5:
-        penalty = min(10, int(added_sugars // 5))
+    if added_sugars > rules.added_sugars_above:
+        penalty = min(rules.added_sugars_max, int(added_sugars // rules.added_sugars_per_point))
         neg_points += penalty
         drivers.append(f"Added sugars: {added_sugars} g/100g")
         evidence.append("WHO: limit added sugar < 10% of daily energy")
 
     # Saturated fat
-    for threshold, pts in [(10, 10), (9, 9), (8, 8), (7, 7), (6, 6),
-                           (5, 5), (4, 4), (3, 3), (2, 2), (1, 1)]:
-        if saturated_fat > threshold:
-            neg_points += pts
-            drivers.append(f"High saturated fat: {saturated_fat} g/100g")
-            evidence.append(f"Saturated fat > {threshold} g/100g")
-            break
+    pts, threshold = rules.ladder("saturated_fat_g", saturated_fat)
+    if threshold is not None:
+        neg_points += pts
+        drivers.append(f"High saturated fat: {saturated_fat} g/100g")
+        evidence.append(f"Saturated fat > {threshold} g/100g")
 
     # Sodium
-    for threshold, pts in [(900, 10), (810, 9), (720, 8), (630, 7), (540, 6),
-                           (450, 5), (360, 4), (270, 3), (180, 2), (90, 1)]:
-        if sodium > threshold:
-            neg_points += pts
-            drivers.append(f"High sodium: {sodium/400:.2f} g salt/100g")
-            evidence.append(f"Sodium > {threshold} mg/100g")
-            break
+    pts, threshold = rules.ladder("sodium_mg", sodium)
+    if threshold is not None:
+        neg_points += pts
+        drivers.append(f"High sodium: {sodium/400:.2f} g salt/100g")
+        evidence.append(f"Sodium > {threshold} mg/100g")
 
     # Ultra-processed foods → extra penalty
     if ultra_processed:
-        neg_points += 3
+        neg_points += rules.ultra_processed_points
         drivers.append("Ultra-processed food penalty")
         evidence.append("Based on NOVA classification: avoid UPFs")
 
     # --- POSITIVE POINTS ---
     # Fiber
-    for threshold, pts in [(4.7, 5), (3.7, 4), (2.8, 3), (1.9, 2), (0.9, 1)]:
-        if fiber > threshold:
-            pos_points += pts
-            drivers.append(f"Good fiber: {fiber} g/100g")
-            evidence.append(f"Fiber > {threshold} g/100g")
-            break
+    pts, threshold = rules.ladder("fiber_g", fiber)
+    if threshold is not None:
+        pos_points += pts
+        drivers.append(f"Good fiber: {fiber} g/100g")
+        evidence.append(f"Fiber > {threshold} g/100g")
 
     # Protein
-    for threshold, pts in [(8.0, 5), (6.4, 4), (4.8, 3), (3.2, 2), (1.6, 1)]:
-        if protein > threshold:
+    pts, threshold = rules.ladder("proteins_g", protein)
+    if threshold is not None:
+        pos_points += pts
+        drivers.append(f"Good protein: {protein} g/100g")
+        evidence.append(f"Protein > {threshold} g/100g")
+
+    # Fruit/Vegetables content (highest tier first)
+    for tier, (cutoff, pts) in enumerate(rules.fruit_veg):
+        if fruit_pct >= cutoff:
             pos_points += pts
-            drivers.append(f"Good protein: {protein} g/100g")
-            evidence.append(f"Protein > {threshold} g/100g")
+            level = "High" if tier == 0 else "Moderate"
+            drivers.append(f"{level} fruit/veg content: {fruit_pct}%")
+            evidence.append(f"Nutri-Score bonus for ≥{cutoff}% fruit/veg")
             break
 
-    # Fruit/Vegetables content
-    if fruit_pct >= 80:
-        pos_points += 5
-        drivers.append(f"High fruit/veg content: {fruit_pct}%")
-        evidence.append("Nutri-Score bonus for ≥80% fruit/veg")
-    elif fruit_pct >= 60:
-        pos_points += 2
-        drivers.append(f"Moderate fruit/veg content: {fruit_pct}%")
-        evidence.append("Nutri-Score bonus for ≥60% fruit/veg")
-
     # --- FINAL SCORE ---
     score_raw = neg_points - pos_points
 
     # Normalize raw score → 0–100 health index
-    score_norm = max(0, min(100, int(100 - ((score_raw + 15) * 2.0))))  
+    score_norm = max(0, min(100, rules.normalize(score_raw)))
 
     # --- Health Index Bands ---
-    if score_norm >= 80:
-        band = "Healthy"
-        grade = "A"
-    elif score_norm >= 65:
-        band = "Lightly Healthy"
-        grade = "B"
-    elif score_norm >= 50:
-        band = "Moderate"
-        grade = "C"
-    elif score_norm >= 35:
-        band = "Less Healthy"
-        grade = "D"
-    else:
-        band = "Unhealthy"
-        grade = "E"
+    band, grade = rules.band(score_norm)
     return score_norm, grade, band, drivers, evidence
+
+
+def _nutrient_columns(frame):
+    """Float columns (missing/NaN -> 0) plus the ultra_processed flags for a batch."""
+    import numpy as np
+    import pandas as pd
+    def column(name):
+        if name not in frame:
+            return np.zeros(len(frame))
+        values = pd.to_numeric(frame[name], errors="coerce").to_numpy(dtype=float)
+        return np.nan_to_num(values, nan=0.0)
+
+    nutrients = {name: column(name) for name in SCORED_NUTRIENTS}
+    nutrients["sodium_mg"] = nutrients["salt_g"] * 400
+    if "ultra_processed" in frame:
+        ultra_processed = frame["ultra_processed"].fillna(False).to_numpy(dtype=bool)
+    else:
+        ultra_processed = np.zeros(len(frame), dtype=bool)
+    return nutrients, ultra_processed
+
+
+def _score_columns(nutrients, ultra_processed, rules):
+    """(score, band, grade) arrays for prepared columns under one ruleset."""
+    import numpy as np
+    added = nutrients["added_sugars_g"]
+    added_penalty = np.minimum(rules.added_sugars_max, added // rules.added_sugars_per_point)
+    neg_points = (rules.ladder_points("energy_kcal", nutrients["energy_kcal"])
+                  + rules.ladder_points("sugars_g", nutrients["sugars_g"])
+                  + np.where(added > rules.added_sugars_above, added_penalty, 0).astype(np.int64)
+                  + rules.ladder_points("saturated_fat_g", nutrients["saturated_fat_g"])
+                  + rules.ladder_points("sodium_mg", nutrients["sodium_mg"])
+                  + np.where(ultra_processed, rules.ultra_processed_points, 0))
+
+    fruit_pct = nutrients["fruit_veg_pct"]
+    fruit_points = np.zeros(len(fruit_pct), dtype=np.int64)
+    for cutoff, pts in reversed(rules.fruit_veg):  # higher tiers overwrite lower ones
+        fruit_points[fruit_pct >= cutoff] = pts
+    pos_points = (rules.ladder_points("fiber_g", nutrients["fiber_g"])
+                  + rules.ladder_points("proteins_g", nutrients["proteins_g"])
+                  + fruit_points)
+
+    score_raw = neg_points - pos_points
+    score_norm = np.clip(np.trunc(100 - (score_raw + rules.offset) * rules.scale), 0, 100).astype(np.int64)
+    band, grade = rules.bands_for(score_norm)
+    return score_norm, band, grade
+
+
+def _explain_columns(nutrients, ultra_processed, rules):
+    """
+    (drivers, evidence) lists per row, worded exactly as calculate_score words
+    them. Thresholds are looked up for whole columns; only the rows a rule
+    fires for get a string formatted.
+    """
+    import numpy as np
+    n = len(ultra_processed)
+    drivers = [[] for _ in range(n)]
+    evidence = [[] for _ in range(n)]
+
+    def add(rows, driver_texts, evidence_texts):
+        for i, driver, proof in zip(rows, driver_texts, evidence_texts):
+            drivers[i].append(driver)
+            evidence[i].append(proof)
+
+    def ladder(name, column, driver, proof):
+        rows, thresholds = rules.ladder_exceeded(name, column)
+        values = column[rows].tolist()
+        add(rows.tolist(), (driver(v) for v in values), (proof(t) for t in thresholds))
+
+    # Same order as calculate_score: negative points, then positive.
+    ladder("energy_kcal", nutrients["energy_kcal"],
+           lambda v: f"Very high energy: {v} kcal/100g", lambda t: f"Energy > {t} kcal/100g")
+    ladder("sugars_g", nutrients["sugars_g"],
+           lambda v: f"High sugar content: {v} g/100g", lambda t: f"Sugars > {t} g/100g")
+    added = nutrients["added_sugars_g"]
+    rows = np.flatnonzero(added > rules.added_sugars_above)
+    add(rows.tolist(), (f"Added sugars: {v} g/100g" for v in added[rows].tolist()),
+        ["WHO: limit added sugar < 10% of daily energy"] * len(rows))
+    ladder("saturated_fat_g", nutrients["saturated_fat_g"],
+           lambda v: f"High saturated fat: {v} g/100g", lambda t: f"Saturated fat > {t} g/100g")
+    ladder("sodium_mg", nutrients["sodium_mg"],
+           lambda v: f"High sodium: {v/400:.2f} g salt/100g", lambda t: f"Sodium > {t} mg/100g")
+    rows = np.flatnonzero(ultra_processed)
+    add(rows.tolist(), ["Ultra-processed food penalty"] * len(rows),
+        ["Based on NOVA classification: avoid UPFs"] * len(rows))
+    ladder("fiber_g", nutrients["fiber_g"],
+           lambda v: f"Good fiber: {v} g/100g", lambda t: f"Fiber > {t} g/100g")
+    ladder("proteins_g", nutrients["proteins_g"],
+           lambda v: f"Good protein: {v} g/100g", lambda t: f"Protein > {t} g/100g")
+    fruit_pct = nutrients["fruit_veg_pct"]
+    unmatched = np.ones(n, dtype=bool)
+    for tier, (cutoff, _) in enumerate(rules.fruit_veg):  # highest tier first
+        hit = unmatched & (fruit_pct >= cutoff)
+        unmatched &= ~hit
+        rows = np.flatnonzero(hit)
+        level = "High" if tier == 0 else "Moderate"
+        add(rows.tolist(), (f"{level} fruit/veg content: {v}%" for v in fruit_pct[rows].tolist()),
+            [f"Nutri-Score bonus for ≥{cutoff}% fruit/veg"] * len(rows))
+    return drivers, evidence
+
+
+@traced("score.batch")
+def calculate_scores(frame, explain=False, ruleset=None):
+    """
+    Vectorized calculate_score over many products at once.
+    `frame` is a pandas DataFrame (or a dict of equal-length columns) using the
+    normalize_nutrient_name field names. Missing columns and values count as 0.
+    Returns a DataFrame with score, grade and band columns on the input index;
+    drivers and evidence lists are only built when `explain` is True.
+    """
+    import pandas as pd  # only the batch paths need it; calculate_score stays NumPy- and pandas-free
+    if not isinstance(frame, pd.DataFrame):
+        frame = pd.DataFrame(frame)
+    rules = resolve_rules(ruleset)
+    nutrients, ultra_processed = _nutrient_columns(frame)
+    score_norm, band, grade = _score_columns(nutrients, ultra_processed, rules)
+
+    result = pd.DataFrame({
+        "score": score_norm,
+        "grade": grade,
+        "band": band,
+    }, index=frame.index)
+
+    if explain:
+        result["drivers"], result["evidence"] = _explain_columns(nutrients, ultra_processed, rules)
+    return result
+
+
+@traced("score.compare")
+def compare_rulesets(frame, rulesets):
+    """
+    Score one batch under several rulesets (Rulesets or version names) for A/B
+    comparison. Nutrient columns are prepared once and reused for each ruleset.
+    Returns a DataFrame with score_<version>, grade_<version> and
+    band_<version> columns on the input index.
+    """
+    import pandas as pd
+    if not isinstance(frame, pd.DataFrame):
+        frame = pd.DataFrame(frame)
+    nutrients, ultra_processed = _nutrient_columns(frame)
+    columns = {}
+    for ruleset in rulesets:
+        rules = resolve_rules(ruleset)
+        score_norm, band, grade = _score_columns(nutrients, ultra_processed, rules)
+        columns[f"score_{rules.version}"] = score_norm
+        columns[f"grade_{rules.version}"] = grade
+        columns[f"band_{rules.version}"] = band
+    return pd.DataFrame(columns, index=frame.index)
@@ -0,0 +1,372 @@
+"""
+Small async HTTP scoring API, for callers that don't go through Streamlit.
+
+    python service.py --host 127.0.0.1 --port 8080
+
+    POST /score              {"energy_kcal": 530, "sugars_g": 56.3, ...}  (or OFF *_100g keys,
+                             or a JSON array of either) -> score, grade, band, drivers, evidence
+    GET  /product/{barcode}  product lookup + normalized ingredients/nutrients + score
+    POST /ocr                {"url": "..."} or raw image bytes -> OCR'd ingredients/nutrients + score
+    GET  /metrics            request counts, 4xx/5xx counts and p50/p99 latency per endpoint
+
+Scoring requests that arrive within BATCH_WINDOW_S of each other are
+coalesced into one calculate_scores call, and concurrent lookups of the same
+barcode share a single acquire call. Built on asyncio streams only, so it
+needs nothing beyond requirements.txt.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote
+import numpy as np
+from acquire import get_product_by_barcode
+from normalize import normalize_ingredients, normalize_nutrient_name, extract_nutrition_from_text, product_ingredients_text
+from score import SCORED_NUTRIENTS, calculate_score, calculate_scores
+
+BATCH_WINDOW_S = 0.002
+MAX_BATCH_SIZE = 1024
+SCALAR_BATCH_MAX = 32  # below this, per-row calculate_score beats the DataFrame setup cost
+LATENCY_SAMPLES = 10000  # most recent requests kept per endpoint for percentiles
+MAX_BODY_BYTES = 20 * 1024 * 1024
+IO_WORKERS = 32
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+            413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+def _score_batch(batch: list) -> list:
+    """score/grade/band/drivers/evidence dicts for a list of nutrient dicts."""
+    if len(batch) <= SCALAR_BATCH_MAX:
+        return [dict(zip(("score", "grade", "band", "drivers", "evidence"), calculate_score(nutrients)))
+                for nutrients in batch]
+    rows = calculate_scores(batch, explain=True).to_dict("records")
+    for row in rows:
+        row["score"] = int(row["score"])
+    return rows
+
+
+class ScoreBatcher:
+    """
+    Collects score requests for a few milliseconds and scores them as one
+    vectorized batch on `executor` (the loop's default executor if None), so
+    scoring never blocks the event loop.
+    """
+
+    def __init__(self, window: float = BATCH_WINDOW_S, max_size: int = MAX_BATCH_SIZE, executor=None):
+        self.window = window
+        self.max_size = max_size
+        self.executor = executor
+        self.batch_sizes = deque(maxlen=LATENCY_SAMPLES)
+        self._pending = []
+        self._flush_handle = None
+
+    async def score(self, nutrients: dict) -> dict:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((nutrients, future))
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        self.batch_sizes.append(len(batch))
+        task = asyncio.get_running_loop().run_in_executor(
+            self.executor, _score_batch, [nutrients for nutrients, _ in batch])
+        task.add_done_callback(lambda task: self._deliver(batch, task))
+
+    @staticmethod
+    def _deliver(batch: list, task):
+        if task.cancelled() or task.exception() is not None:
+            error = task.exception() if not task.cancelled() else asyncio.CancelledError()
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        for (_, future), row in zip(batch, task.result()):
+            if not future.done():
+                future.set_result(row)
+
+
+class SingleFlight:
+    """Runs one blocking call per key at a time; concurrent callers share its result."""
+
+    def __init__(self, executor):
+        self.executor = executor
+        self._inflight = {}
+        self.shared = 0
+
+    async def run(self, key, func, *args):
+        task = self._inflight.get(key)
+        if task is None:
+            loop = asyncio.get_running_loop()
+            task = asyncio.ensure_future(loop.run_in_executor(self.executor, func, *args))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+
+class Metrics:
+    """Per-endpoint request counts, 4xx (rejected) and 5xx (errors) counts, and recent latencies."""
+
+    def __init__(self):
+        self.latencies = defaultdict(lambda: deque(maxlen=LATENCY_SAMPLES))
+        self.counts = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.rejected = defaultdict(int)
+
+    def observe(self, endpoint: str, seconds: float, status: int):
+        self.latencies[endpoint].append(seconds)
+        self.counts[endpoint] += 1
+        if status >= 500:
+            self.errors[endpoint] += 1
+        elif status >= 400:
+            self.rejected[endpoint] += 1
+
+    def snapshot(self) -> dict:
+        report = {}
+        for endpoint, samples in self.latencies.items():
+            p50, p99 = np.percentile(np.fromiter(samples, float), [50, 99]) * 1e3
+            report[endpoint] = {"count": self.counts[endpoint], "errors": self.errors[endpoint],
+                                "rejected": self.rejected[endpoint],
+                                "p50_ms": round(p50, 3), "p99_ms": round(p99, 3)}
+        return report
+
+
+def _to_number(key: str, value) -> float:
+    try:
+        if isinstance(value, bool):
+            raise TypeError
+        number = float(value)
+    except (TypeError, ValueError):
+        raise HttpError(400, f"{key} must be a number, got {value!r}") from None
+    if not math.isfinite(number):
+        raise HttpError(400, f"{key} must be finite, got {value!r}")
+    return number
+
+
+def _to_nutrients(payload) -> dict:
+    """
+    Accept normalized field names or raw OFF *_100g keys. Scored nutrients
+    must be numbers (numeric strings are converted); anything else is a 400.
+    """
+    if not isinstance(payload, dict):
+        raise HttpError(400, "expected a JSON object of nutrients")
+    raw_keys = [key for key in payload if key.endswith("_100g")]
+    if raw_keys:
+        for key in raw_keys:  # normalize_nutrient_name would quietly turn bad values into None
+            if payload[key] not in (None, ""):
+                _to_number(key, payload[key])
+        payload = normalize_nutrient_name(payload)
+    nutrients = {k: (v or 0) for k, v in payload.items()}
+    for key in SCORED_NUTRIENTS:
+        if key in nutrients:
+            nutrients[key] = _to_number(key, nutrients[key])
+    if not isinstance(nutrients.get("ultra_processed", False), (bool, int)):
+        raise HttpError(400, "ultra_processed must be true or false")
+    return nutrients
+
+
+class ScoringService:
+    def __init__(self, batch_window: float = BATCH_WINDOW_S):
+        self.executor = ThreadPoolExecutor(max_workers=IO_WORKERS)
+        self.batcher = ScoreBatcher(window=batch_window, executor=self.executor)
+        self.products = SingleFlight(self.executor)
+        self.ocr_jobs = SingleFlight(self.executor)
+        self.metrics = Metrics()
+
+    async def _scored(self, nutrients: dict) -> dict:
+        result = await self.batcher.score(nutrients)
+        return {
+            "score": {"value": result["score"], "band": result["band"], "grade": result["grade"]},
+            "explanation": {"drivers": result["drivers"], "evidence": result["evidence"]},
+        }
+
+    async def handle_score(self, body: bytes) -> dict:
+        payload = _parse_json(body)
+        if isinstance(payload, list):
+            nutrients = [_to_nutrients(item) for item in payload]
+            return await asyncio.gather(*(self._scored(n) for n in nutrients))
+        nutrients = _to_nutrients(payload)
+        return dict(await self._scored(nutrients), nutrients=nutrients)
+
+    async def handle_product(self, barcode: str) -> dict:
+        product = await self.products.run(barcode, get_product_by_barcode, barcode)
+        if product is None:
+            raise HttpError(404, f"no product for barcode {barcode}")
+        nutrients, ingredients = await asyncio.get_running_loop().run_in_executor(
+            self.executor, _normalize_product, product)
+        return dict(await self._scored(nutrients), barcode=barcode,
+                    product_name=product.get("product_name", ""),
+                    ingredients=ingredients, nutrients=nutrients)
+
+    async def handle_ocr(self, body: bytes, content_type: str) -> dict:
+        import ocr  # PIL/pytesseract are only needed by this endpoint
+        if content_type.startswith("application/json"):
+            payload = _parse_json(body)
+            url = payload.get("url") if isinstance(payload, dict) else None
+            if not url:
+                raise HttpError(400, 'expected {"url": ...} or raw image bytes')
+            text = await self.ocr_jobs.run(url, ocr.ocr_url, url)
+        elif body:
+            text = await self.ocr_jobs.run(hashlib.sha256(body).hexdigest(), ocr.ocr_bytes, body)
+        else:
+            raise HttpError(400, "empty request body")
+        nutrients, ingredients = await asyncio.get_running_loop().run_in_executor(
+            self.executor, _normalize_text, text)
+        return dict(await self._scored(nutrients), ingredients=ingredients,
+                    nutrients=nutrients, text=text)
+
+    async def dispatch(self, method: str, path: str, body: bytes, headers: dict):
+        """Route a request; returns a JSON-able result."""
+        if path == "/score":
+            _require(method, "POST")
+            return await self.handle_score(body)
+        if path.startswith("/product/"):
+            _require(method, "GET")
+            barcode = unquote(path[len("/product/"):]).strip()
+            if not barcode.isdigit():
+                raise HttpError(400, "barcode must be digits")
+            return await self.handle_product(barcode)
+        if path == "/ocr":
+            _require(method, "POST")
+            return await self.handle_ocr(body, headers.get("content-type", ""))
+        if path == "/metrics":
+            _require(method, "GET")
+            sizes = self.batcher.batch_sizes
+            return {
+                "endpoints": self.metrics.snapshot(),
+                "score_batches": {"count": len(sizes), "mean_size": round(float(np.mean(sizes)), 2) if sizes else 0},
+                "single_flight_shared": self.products.shared + self.ocr_jobs.shared,
+            }
+        raise HttpError(404, f"no route for {path}")
+
+    async def handle_connection(self, reader, writer):
+        """HTTP/1.1 with keep-alive; one request at a time per connection."""
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+                started = time.perf_counter()
+                lines = head.decode("latin-1").split("\r\n")
+                try:
+                    method, target, version = lines[0].split(" ", 2)
+                except ValueError:
+                    break
+                headers = {}
+                for line in lines[1:]:
+                    if ":" in line:
+                        name, value = line.split(":", 1)
+                        headers[name.strip().lower()] = value.strip()
+                try:
+                    length = int(headers.get("content-length") or 0)
+                except ValueError:
+                    length = -1
+                path = target.split("?", 1)[0]
+                endpoint = _endpoint(path)  # resolved up front, so 4xx responses count under their route
+                try:
+                    if length < 0:
+                        raise HttpError(400, "invalid Content-Length")
+                    if length > MAX_BODY_BYTES:
+                        raise HttpError(413, "request body too large")
+                    body = await reader.readexactly(length) if length else b""
+                    result = await self.dispatch(method, path, body, headers)
+                    status = 200
+                except HttpError as e:
+                    status, result = e.status, {"error": str(e)}
+                except Exception as e:
+                    logging.exception(f"[SERVICE] {method} {target} failed")
+                    status, result = 500, {"error": f"{type(e).__name__}: {e}"}
+                keep_alive = (headers.get("connection", "").lower() != "close"
+                              and version == "HTTP/1.1" and status != 413 and length >= 0)
+                payload = json.dumps(result, ensure_ascii=False).encode("utf-8")
+                writer.write(
+                    f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+                    f"Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1")
+                    + payload)
+                await writer.drain()
+                self.metrics.observe(endpoint, time.perf_counter() - started, status)
+                if not keep_alive:
+                    break
+        finally:
+            writer.close()
+
+
+def _endpoint(path: str) -> str:
+    """Metrics name for a request path; unknown paths count as "other"."""
+    if path.startswith("/product/"):
+        return "/product"
+    return path if path in ("/score", "/ocr", "/metrics") else "other"
+
+
+def _normalize_product(product: dict):
+    """(nutrients, ingredients) for an OFF product; run on the executor."""
+    nutrients = {k: (v or 0) for k, v in normalize_nutrient_name(product.get("nutriments") or {}).items()}
+    ingredients = product.get("ingredients_normalized")
+    if ingredients is None:
+        ingredients = normalize_ingredients(*product_ingredients_text(product))
+    return nutrients, ingredients
+
+
+def _normalize_text(text: str):
+    """(nutrients, ingredients) read from OCR text; run on the executor."""
+    nutrients = {k: (v or 0) for k, v in extract_nutrition_from_text(text).items()}
+    return nutrients, normalize_ingredients(text)
+
+
+def _require(method: str, expected: str):
+    if method != expected:
+        raise HttpError(405, f"use {expected}")
+
+
+def _parse_json(body: bytes):
+    try:
+        return json.loads(body or b"null")
+    except ValueError:
+        raise HttpError(400, "request body is not valid JSON")
+
+
+async def serve(host: str = "127.0.0.1", port: int = 8080, batch_window: float = BATCH_WINDOW_S):
+    service = ScoringService(batch_window=batch_window)
+    server = await asyncio.start_server(service.handle_connection, host, port)
+    logging.info(f"[SERVICE] Listening on http://{host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    parser = argparse.ArgumentParser(description="Serve the health scorer over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--batch-window-ms", type=float, default=BATCH_WINDOW_S * 1e3,
+                        help="how long to collect /score requests into one batch")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, args.batch_window_ms / 1e3))
+    except KeyboardInterrupt:
+        pass
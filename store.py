@@ -0,0 +1,278 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+
+# Nutriment keys kept from OFF records; normalize_nutrient_name reads these.
+NUTRIMENT_FIELDS = (
+    "energy-kcal_100g", "sugars_100g", "salt_100g", "fat_100g",
+    "saturated-fat_100g", "fiber_100g", "proteins_100g",
+)
+# Normalized nutrient columns, as produced by normalize_nutrient_name.
+NUTRIENT_COLUMNS = (
+    "energy_kcal", "sugars_g", "salt_g", "fat_g",
+    "saturated_fat_g", "fiber_g", "proteins_g",
+)
+PRODUCT_COLUMNS = ("code", "product_name", "brands", "lang", "image_url", "ingredients_text")
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS products (
+    code TEXT PRIMARY KEY,
+    product_name TEXT,
+    brands TEXT,
+    lang TEXT,
+    image_url TEXT,
+    ingredients_text TEXT,
+    ingredients TEXT,
+    nutriments TEXT,
+    {", ".join(f"{col} REAL" for col in NUTRIENT_COLUMNS)},
+    content_hash TEXT
+);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS scores (
+    code TEXT NOT NULL,
+    ruleset TEXT NOT NULL,
+    rules_hash TEXT,
+    input_hash TEXT,
+    score INTEGER,
+    grade TEXT,
+    band TEXT,
+    drivers TEXT,
+    evidence TEXT,
+    scored_at REAL,
+    PRIMARY KEY (code, ruleset)
+);
+"""
+
+# Full-text index over names and brands, kept in sync with products by triggers.
+# prefix='2 3' lets short type-ahead prefixes hit a prebuilt index.
+_SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+    product_name, brands, content='products', content_rowid='rowid',
+    tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+);
+CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+    INSERT INTO products_fts (rowid, product_name, brands)
+    VALUES (new.rowid, new.product_name, new.brands);
+END;
+CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+    INSERT INTO products_fts (products_fts, rowid, product_name, brands)
+    VALUES ('delete', old.rowid, old.product_name, old.brands);
+END;
+CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE ON products BEGIN
+    INSERT INTO products_fts (products_fts, rowid, product_name, brands)
+    VALUES ('delete', old.rowid, old.product_name, old.brands);
+    INSERT INTO products_fts (rowid, product_name, brands)
+    VALUES (new.rowid, new.product_name, new.brands);
+END;
+"""
+_SEARCH_TERM_RE = re.compile(r"\w+")
+SEARCH_CANDIDATES = 500  # matches ranked per short-prefix search(); see its docstring
+SEARCH_PREFIX_INDEX = 3  # longest prefix in the index's prefix='2 3'
+
+
+def content_hash(row: dict) -> str:
+    """Hash of the scoring inputs of a store row: normalized nutrients and ingredients."""
+    # Floats as SQLite returns them, so hashes match whether computed on write or on read.
+    nutrients = [None if row.get(col) is None else float(row[col]) for col in NUTRIENT_COLUMNS]
+    payload = json.dumps([nutrients, row.get("ingredients") or []],
+                         separators=(",", ":"), ensure_ascii=False)
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class ProductStore:
+    """
+    Local SQLite product store indexed by barcode. Each row keeps the raw
+    fields the app shows, the normalized ingredient list and one REAL column
+    per normalized nutrient, so products can be served without the OFF API.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # INSERT OR REPLACE only fires the delete trigger with recursive triggers on.
+        self._conn.execute("PRAGMA recursive_triggers=ON")
+        self._conn.executescript(_SCHEMA)
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(products)")}
+        if "content_hash" not in columns:  # stores created before scores were tracked
+            self._conn.execute("ALTER TABLE products ADD COLUMN content_hash TEXT")
+        has_index = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'products_fts'").fetchone()
+        self._conn.executescript(_SEARCH_SCHEMA)
+        if not has_index:
+            self.rebuild_search_index()
+
+    def put_many(self, rows, meta: dict = None):
+        """
+        Insert or replace rows (dicts with PRODUCT_COLUMNS, "ingredients",
+        "nutriments" and NUTRIENT_COLUMNS). `meta` is written in the same
+        transaction, which is how importers checkpoint their progress.
+        """
+        columns = PRODUCT_COLUMNS + ("ingredients", "nutriments") + NUTRIENT_COLUMNS + ("content_hash",)
+        sql = (f"INSERT OR REPLACE INTO products ({', '.join(columns)}) "
+               f"VALUES ({', '.join('?' * len(columns))})")
+        values = [
+            tuple(row.get(col) for col in PRODUCT_COLUMNS)
+            + (json.dumps(row.get("ingredients") or []), json.dumps(row.get("nutriments") or {}))
+            + tuple(row.get(col) for col in NUTRIENT_COLUMNS)
+            + (content_hash(row),)
+            for row in rows
+        ]
+        with self._lock, self._conn:
+            self._conn.executemany(sql, values)
+            for key, value in (meta or {}).items():
+                self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                                   (key, json.dumps(value)))
+
+    def get(self, code: str) -> dict:
+        """Return the product in OFF product-dict shape, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(PRODUCT_COLUMNS)}, ingredients, nutriments "
+                "FROM products WHERE code = ?", (code,)
+            ).fetchone()
+        if row is None:
+            return None
+        return self._to_product(row)
+
+    def iter_products(self, batch_size: int = 10000):
+        """Yield every stored product (as get() returns them) in insertion order."""
+        last = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT rowid, {', '.join(PRODUCT_COLUMNS)}, ingredients, nutriments "
+                    "FROM products WHERE rowid > ? ORDER BY rowid LIMIT ?", (last, batch_size)).fetchall()
+            if not rows:
+                return
+            last = rows[-1][0]
+            for row in rows:
+                yield self._to_product(row[1:])
+
+    @staticmethod
+    def _to_product(row) -> dict:
+        product = dict(zip(PRODUCT_COLUMNS, row))
+        product["ingredients_normalized"] = json.loads(row[len(PRODUCT_COLUMNS)])
+        product["nutriments"] = json.loads(row[len(PRODUCT_COLUMNS) + 1])
+        return product
+
+    def search(self, query: str, limit: int = 10, candidates: int = SEARCH_CANDIDATES) -> list:
+        """
+        Name/brand search ranked by BM25 (names weighted over brands). Every
+        word must match, the last one as a prefix, so partially typed queries
+        work. Returns product dicts.
+
+        Every match is ranked once the last word is longer than the prefix
+        index (SEARCH_PREFIX_INDEX characters). For a shorter last word, which
+        is type-ahead over a very broad prefix, only the first `candidates`
+        matches in insertion order are ranked; the best-ranked product may
+        then be missed until the next keystroke. Pass candidates=None to rank
+        every match anyway; a one-letter prefix over millions of rows then
+        takes hundreds of milliseconds.
+        """
+        terms = _SEARCH_TERM_RE.findall(query.lower())
+        if not terms:
+            return []
+        match = " ".join(f'"{term}"' for term in terms[:-1]) + f' "{terms[-1]}"*'
+        if candidates is None or len(terms[-1]) > SEARCH_PREFIX_INDEX:
+            hits, params = ("SELECT rowid, bm25(products_fts, 2.0, 1.0) AS score FROM products_fts "
+                            "WHERE products_fts MATCH ? ORDER BY score LIMIT ?"), (match, limit)
+        else:
+            hits, params = ("SELECT rowid, bm25(products_fts, 2.0, 1.0) AS score FROM products_fts "
+                            "WHERE products_fts MATCH ? LIMIT ?"), (match, candidates)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join('p.' + col for col in PRODUCT_COLUMNS)}, p.ingredients, p.nutriments "
+                f"FROM ({hits}) AS hits JOIN products p ON p.rowid = hits.rowid ORDER BY hits.score LIMIT ?",
+                params + (limit,),
+            ).fetchall()
+        return [self._to_product(row) for row in rows]
+
+    def iter_stale_scores(self, ruleset: str, rules_hash: str, batch_size: int = 10000, force: bool = False):
+        """
+        Yield batches of products whose stored score for `ruleset` is missing,
+        was computed from different inputs, or under a different rules_hash.
+        Each item is a dict of code, content_hash and NUTRIENT_COLUMNS.
+        """
+        self.backfill_content_hashes()
+        stale = "1" if force else "(s.code IS NULL OR s.input_hash IS NOT p.content_hash OR s.rules_hash IS NOT ?)"
+        sql = (f"SELECT p.rowid, p.code, p.content_hash, {', '.join('p.' + col for col in NUTRIENT_COLUMNS)} "
+               "FROM products p LEFT JOIN scores s ON s.code = p.code AND s.ruleset = ? "
+               f"WHERE p.rowid > ? AND {stale} ORDER BY p.rowid LIMIT ?")
+        last = 0
+        while True:
+            params = (ruleset, last) + (() if force else (rules_hash,)) + (batch_size,)
+            with self._lock:
+                rows = self._conn.execute(sql, params).fetchall()
+            if not rows:
+                return
+            last = rows[-1][0]
+            yield [dict(zip(("code", "content_hash") + NUTRIENT_COLUMNS, row[1:])) for row in rows]
+
+    def backfill_content_hashes(self, batch_size: int = 10000) -> int:
+        """Hash rows written before content hashes existed; returns how many were filled."""
+        filled = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    f"SELECT rowid, ingredients, {', '.join(NUTRIENT_COLUMNS)} FROM products "
+                    "WHERE content_hash IS NULL LIMIT ?", (batch_size,)).fetchall()
+            if not rows:
+                return filled
+            updates = []
+            for rowid, ingredients, *nutrients in rows:
+                row = dict(zip(NUTRIENT_COLUMNS, nutrients), ingredients=json.loads(ingredients or "[]"))
+                updates.append((content_hash(row), rowid))
+            with self._lock, self._conn:
+                self._conn.executemany("UPDATE products SET content_hash = ? WHERE rowid = ?", updates)
+            filled += len(updates)
+
+    def put_scores(self, ruleset: str, rules_hash: str, scores):
+        """Upsert scores: dicts with code, input_hash, score, grade, band, drivers, evidence."""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO scores (code, ruleset, rules_hash, input_hash, score, grade, band, "
+                "drivers, evidence, scored_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, strftime('%s', 'now'))",
+                [(s["code"], ruleset, rules_hash, s["input_hash"], int(s["score"]), s["grade"], s["band"],
+                  json.dumps(s.get("drivers") or []), json.dumps(s.get("evidence") or []))
+                 for s in scores])
+
+    def get_score(self, code: str, ruleset: str) -> dict:
+        """The stored score of a product under `ruleset`, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT score, grade, band, drivers, evidence, rules_hash, input_hash FROM scores "
+                "WHERE code = ? AND ruleset = ?", (code, ruleset)).fetchone()
+        if row is None:
+            return None
+        return {"score": row[0], "grade": row[1], "band": row[2], "drivers": json.loads(row[3]),
+                "evidence": json.loads(row[4]), "rules_hash": row[5], "input_hash": row[6]}
+
+    def rebuild_search_index(self):
+        """Rebuild the full-text index from the products table."""
+        with self._lock, self._conn:
+            self._conn.execute("INSERT INTO products_fts (products_fts) VALUES ('rebuild')")
+
+    def get_meta(self, key: str, default=None):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_meta(self, key: str, value):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                               (key, json.dumps(value)))
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+
+    def close(self):
+        self._conn.close()
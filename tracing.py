@@ -0,0 +1,315 @@
+"""
+Stage timing for the acquire -> normalize -> score pipeline.
+
+Every instrumented stage runs inside span(name), which times it with
+perf_counter_ns and adds the duration to a per-stage histogram. Spans nest
+per thread/task, so a slow request can be broken down into HTTP fetch,
+image decode, preprocessing, tesseract, normalization and scoring time.
+
+    FOOD_TRACE=1                  time spans (off by default; set_tracing() at runtime)
+    FOOD_TRACE_PATH=spans.jsonl   also append every finished span as a JSON line (implies FOOD_TRACE=1)
+    FOOD_PROFILE=cprofile         profile runs wrapped in profiled() (or "pyinstrument")
+    FOOD_PROFILE_PATH=run.prof    where the profile goes (default profile.prof / profile.html)
+
+    python tracing.py report spans.jsonl -o trace.txt    trace.txt-style per-product report
+    python tracing.py stats spans.jsonl                  per-stage latency table
+"""
+import argparse
+import contextvars
+import functools
+import itertools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+TRACE_PATH = os.environ.get("FOOD_TRACE_PATH")
+# Disabled, span() and @traced cost one flag check, so per-row functions
+# (calculate_score, normalize_nutrient_name, ...) run at full speed.
+_enabled = bool(TRACE_PATH) or os.environ.get("FOOD_TRACE", "").lower() not in ("", "0", "off", "false")
+PROFILE_MODE = os.environ.get("FOOD_PROFILE", "").lower()
+PROFILE_PATH = os.environ.get("FOOD_PROFILE_PATH")
+
+# Histogram buckets are powers of two in microseconds: bucket i holds
+# durations below 2**i µs, up to ~2**40 µs (12 days).
+_BUCKETS = 41
+
+_current = contextvars.ContextVar("current_span", default=None)
+_span_ids = itertools.count(1)
+_lock = threading.Lock()
+_histograms = {}
+_trace_file = None
+
+
+class Histogram:
+    """Log-scale latency histogram with exact count/sum/min/max."""
+
+    def __init__(self):
+        self.buckets = [0] * _BUCKETS
+        self.count = 0
+        self.total_ns = 0
+        self.min_ns = None
+        self.max_ns = 0
+
+    def add(self, duration_ns: int):
+        self.buckets[min(_BUCKETS - 1, (duration_ns // 1000).bit_length())] += 1
+        self.count += 1
+        self.total_ns += duration_ns
+        self.min_ns = duration_ns if self.min_ns is None else min(self.min_ns, duration_ns)
+        self.max_ns = max(self.max_ns, duration_ns)
+
+    def percentile(self, p: float) -> float:
+        """Approximate percentile in ms (upper edge of the bucket it falls in)."""
+        if not self.count:
+            return 0.0
+        rank = p / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n:
+                return min(2 ** i / 1000, self.max_ns / 1e6)
+        return self.max_ns / 1e6
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "total_ms": round(self.total_ns / 1e6, 3),
+            "mean_ms": round(self.total_ns / 1e6 / self.count, 3) if self.count else 0.0,
+            "min_ms": round((self.min_ns or 0) / 1e6, 3),
+            "p50_ms": round(self.percentile(50), 3),
+            "p99_ms": round(self.percentile(99), 3),
+            "max_ms": round(self.max_ns / 1e6, 3),
+        }
+
+
+class Span:
+    __slots__ = ("name", "attrs", "span_id", "parent_id", "trace_id", "start_ns", "duration_ns")
+
+    def __init__(self, name: str, attrs: dict, parent):
+        self.name = name
+        self.attrs = attrs
+        self.span_id = next(_span_ids)
+        self.parent_id = parent.span_id if parent else None
+        self.trace_id = parent.trace_id if parent else f"{os.getpid()}-{self.span_id}"
+        self.start_ns = 0
+        self.duration_ns = 0
+
+    def set(self, **attrs):
+        """Attach attributes (e.g. cache hit/miss, sizes) to the span."""
+        self.attrs.update(attrs)
+
+    def to_dict(self) -> dict:
+        return {"trace": self.trace_id, "span": self.span_id, "parent": self.parent_id,
+                "name": self.name, "start_ns": self.start_ns,
+                "duration_ms": round(self.duration_ns / 1e6, 4), **self.attrs}
+
+
+def set_tracing(enabled: bool = True):
+    """Turn span timing on or off for the whole process."""
+    global _enabled
+    _enabled = enabled
+
+
+def tracing_enabled() -> bool:
+    return _enabled
+
+
+class _NullSpan:
+    """Stands in for a Span while tracing is off."""
+    __slots__ = ()
+
+    def set(self, **attrs):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+@contextmanager
+def _null_span():
+    yield _NULL_SPAN
+
+
+def span(name: str, **attrs):
+    """Time the enclosed block as stage `name`; yields the Span for set()."""
+    if not _enabled:
+        return _null_span()
+    return _span(name, attrs)
+
+
+@contextmanager
+def _span(name: str, attrs: dict):
+    parent = _current.get()
+    current = Span(name, attrs, parent)
+    token = _current.set(current)
+    current.start_ns = time.time_ns()
+    started = time.perf_counter_ns()
+    try:
+        yield current
+    except BaseException as e:
+        current.attrs["error"] = type(e).__name__
+        raise
+    finally:
+        current.duration_ns = time.perf_counter_ns() - started
+        _current.reset(token)
+        _record(current)
+
+
+def traced(name: str):
+    """Decorator form of span() for functions that are a stage in their own right."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _span(name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def annotate(**attrs):
+    """Attach attributes to the innermost open span, if any."""
+    current = _current.get()
+    if current is not None:
+        current.attrs.update(attrs)
+
+
+def _record(finished: Span):
+    global _trace_file
+    with _lock:
+        histogram = _histograms.get(finished.name)
+        if histogram is None:
+            histogram = _histograms[finished.name] = Histogram()
+        histogram.add(finished.duration_ns)
+        if TRACE_PATH:
+            if _trace_file is None:
+                if os.path.dirname(TRACE_PATH):
+                    os.makedirs(os.path.dirname(TRACE_PATH), exist_ok=True)
+                _trace_file = open(TRACE_PATH, "a", encoding="utf-8", buffering=1)
+            _trace_file.write(json.dumps(finished.to_dict(), ensure_ascii=False, default=str) + "\n")
+
+
+def stage_stats() -> dict:
+    """Histogram summaries for every stage timed in this process so far."""
+    with _lock:
+        return {name: h.summary() for name, h in sorted(_histograms.items())}
+
+
+def reset_stats():
+    with _lock:
+        _histograms.clear()
+
+
+def format_stats(stats: dict) -> str:
+    """Fixed-width per-stage latency table."""
+    lines = [f"{'stage':<28}{'count':>9}{'total ms':>12}{'mean ms':>10}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}"]
+    for name, s in stats.items():
+        lines.append(f"{name:<28}{s['count']:>9}{s['total_ms']:>12.1f}{s['mean_ms']:>10.3f}"
+                     f"{s['p50_ms']:>10.3f}{s['p99_ms']:>10.3f}{s['max_ms']:>10.3f}")
+    return "\n".join(lines)
+
+
+@contextmanager
+def profiled(mode: str = None, path: str = None):
+    """
+    Profile the enclosed block with cProfile or pyinstrument when `mode`
+    (default: FOOD_PROFILE) asks for it; otherwise do nothing.
+    """
+    mode = (mode if mode is not None else PROFILE_MODE).lower()
+    if mode in ("", "0", "off", "none"):
+        yield
+        return
+    if mode == "pyinstrument":
+        from pyinstrument import Profiler  # optional; only needed for this mode
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            path = path or PROFILE_PATH or "profile.html"
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(profiler.output_html())
+            logging.info(f"[PROFILE] pyinstrument report written to {path}")
+        return
+    if mode != "cprofile":
+        raise ValueError(f"unknown profile mode {mode!r} (use cprofile or pyinstrument)")
+    import cProfile
+    import pstats
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        path = path or PROFILE_PATH or "profile.prof"
+        profiler.dump_stats(path)
+        logging.info(f"[PROFILE] cProfile stats written to {path}")
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(15)
+
+
+def load_spans(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def spans_to_stats(spans) -> dict:
+    """Rebuild stage histograms from recorded spans (e.g. from several processes)."""
+    histograms = {}
+    for s in spans:
+        histograms.setdefault(s["name"], Histogram()).add(int(s["duration_ms"] * 1e6))
+    return {name: h.summary() for name, h in sorted(histograms.items())}
+
+
+def trace_report(spans) -> str:
+    """
+    trace.txt-style report: one block per root span, listing its stages in
+    the order they started with their timings and attributes.
+    """
+    children = {}
+    roots = []
+    for s in sorted(spans, key=lambda s: s["start_ns"]):
+        key = (s["trace"], s["parent"])
+        if s["parent"] is None:
+            roots.append(s)
+        children.setdefault(key, []).append(s)
+
+    skip = {"trace", "span", "parent", "name", "start_ns", "duration_ms", "product"}
+
+    def describe(s):
+        details = ", ".join(f"{k}={v}" for k, v in s.items() if k not in skip)
+        return f"{s['name']}" + (f" → {details}" if details else "") + f" ({s['duration_ms']:.2f} ms)"
+
+    def walk(parent, depth, lines):
+        for child in children.get((parent["trace"], parent["span"]), []):
+            lines.append("  " * depth + f"- {describe(child)}")
+            walk(child, depth + 1, lines)
+
+    blocks = []
+    for root in roots:
+        lines = [f"[TRACE] Product = {root.get('product') or root['name']} ({root['duration_ms']:.2f} ms total)"]
+        for step, child in enumerate(children.get((root["trace"], root["span"]), []), 1):
+            lines.append(f"Step {step}: {describe(child)}")
+            walk(child, 1, lines)
+        blocks.append("\n".join(lines))
+    return "\n\n".join(blocks)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize spans recorded with FOOD_TRACE_PATH.")
+    parser.add_argument("command", choices=("report", "stats"))
+    parser.add_argument("spans", help="JSONL span file")
+    parser.add_argument("-o", "--output", help="write to this file instead of stdout")
+    args = parser.parse_args()
+
+    recorded = load_spans(args.spans)
+    text = trace_report(recorded) if args.command == "report" else format_stats(spans_to_stats(recorded))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)